@@ -0,0 +1,479 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+import argparse
+import tempfile
+import subprocess
+import threading
+import statistics
+import shutil
+import json
+import time
+import sys
+import os
+import re
+
+# Progress bars are disabled before tqdm is imported by the extraction
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+from standin_server import StandInServer
+import pandas as pd
+from benchmark_baselines import legacy_parse_images, legacy_build_json_output, legacy_extract_images
+import mediawiki_action_api
+import instrumentation
+import storage
+import http_client
+import wikiprojects
+
+
+RESULTS_PATH = "benchmark_results.json"
+
+# Benchmarks, and their default sizes
+BENCHMARKS = {
+    "extraction": [1000, 10000, 100000],
+    "parser": [10000],
+    "json": [10000, 100000, 1000000],
+    "images": [100000],
+    "startup": [5],
+}
+
+# Modules loaded only when an extraction starts, never at the startup of the tool
+STARTUP_LAZY_MODULES = ["extraction", "pandas", "numpy", "tqdm"]
+
+# Seconds allowed for the startup of the tool
+MAX_STARTUP_TIME = 2.0
+
+# Largest size run with the previous implementations, whose time is quadratic
+BASELINE_MAX_SIZE = 100000
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog="benchmark",
+        description="Run the extraction against a local stand-in of the Wikipedia and wp1 APIs, "
+                    "or compare a stage with its previous implementation on synthetic data."
+    )
+    parser.add_argument("benchmark", nargs="?", choices=list(BENCHMARKS), default="extraction",
+                        help="extraction: full extraction of stand-in projects (default); "
+                             "parser: wikitext pages parsed per second, against the previous parser; "
+                             "json: JSON output of synthetic projects, scaling with the number of images; "
+                             "images: images extraction of synthetic projects, against the previous implementation; "
+                             "startup: imports of extraction_tool.py, which must not load the extraction")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        help="Number of articles of the benchmark projects, of pages of the parser corpus, "
+                             "of images of the JSON output or of startups measured "
+                             f"(default: {BENCHMARKS['extraction']}, {BENCHMARKS['parser']}, {BENCHMARKS['json']}, "
+                             f"{BENCHMARKS['images']} and {BENCHMARKS['startup']})")
+    parser.add_argument("--baseline-max-size", type=int, default=BASELINE_MAX_SIZE,
+                        help=f"Largest size also run with the previous implementation (default: {BASELINE_MAX_SIZE})")
+    parser.add_argument("--images-per-article", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds added to every response of the stand-in server")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of the requests answered with 429, 503 or maxlag errors")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Processes parsing the wikitext, also measured by the parser benchmark when more than 1")
+    parser.add_argument("--discovery", choices=["wikitext", "api"], default="wikitext")
+    parser.add_argument("--storage", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--pipeline", action="store_true")
+    parser.add_argument("--no-trace-memory", dest="trace_memory", action="store_false",
+                        help="Do not measure the peak memory of the stages (tracemalloc slows down the run)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Save a cProfile of every stage in the benchmark output folder")
+    parser.add_argument("--sample-interval", type=float, default=1.0,
+                        help="Seconds between two samples of the request throughput")
+    parser.add_argument("--max-startup-time", type=float, default=MAX_STARTUP_TIME,
+                        help=f"Seconds allowed for the startup of the tool (default: {MAX_STARTUP_TIME})")
+    parser.add_argument("--results", default=RESULTS_PATH,
+                        help=f"File where the results are appended (default: {RESULTS_PATH})")
+
+    parsed = parser.parse_args(args)
+    if parsed.sizes is None:
+        parsed.sizes = BENCHMARKS[parsed.benchmark]
+
+    return parsed
+
+
+def install(url):
+    # Send every request of the extraction to the stand-in server
+    mediawiki_action_api.API_URL = f"{url}/w/api.php"
+    mediawiki_action_api.INDEX_URL = f"{url}/w/index.php"
+    wikiprojects.WP1_URL = f"{url}/v1/projects"
+
+    # The local server is not rate limited
+    http_client.RATE = 10 ** 6
+    http_client.BURST = 10 ** 6
+    http_client.MAX_CONCURRENCY = 256
+
+
+def sample_throughput(samples, stop, interval):
+    start = time.perf_counter()
+    previous = 0
+
+    while not stop.wait(interval):
+        requests = instrumentation.totals["requests"]
+        samples.append({
+            "time": round(time.perf_counter() - start, 3),
+            "requests": requests,
+            "requests_per_sec": round((requests - previous) / interval, 1),
+        })
+        previous = requests
+
+
+def run(size, options):
+    from extraction import full_extraction
+
+    workdir = tempfile.mkdtemp(prefix="vcat_benchmark_")
+    cwd = os.getcwd()
+
+    server = StandInServer(articles=size, images_per_article=options.images_per_article, image_pool=max(1, size // 2),
+                           latency=options.latency, error_rate=options.error_rate)
+
+    samples = []
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_throughput, args=(samples, stop, options.sample_interval), daemon=True)
+
+    with server:
+        install(server.url)
+        os.chdir(workdir)
+
+        try:
+            os.makedirs("output/wp_Benchmark")
+
+            sampler.start()
+            start = time.perf_counter()
+
+            full_extraction("Benchmark", "wp", workers=options.workers, processes=options.processes, discovery=options.discovery,
+                            storage=options.storage, pipeline=options.pipeline, profile=options.profile,
+                            trace_memory=options.trace_memory)
+
+            wall_time = time.perf_counter() - start
+            stop.set()
+            sampler.join()
+
+            with open("output/wp_Benchmark/run_report.json") as infile:
+                report = json.load(infile)
+
+            if options.profile:
+                profiles_dir = os.path.join(cwd, f"benchmark_profiles_{size}")
+                shutil.rmtree(profiles_dir, ignore_errors=True)
+                shutil.copytree("output/wp_Benchmark", profiles_dir,
+                                ignore=lambda path, names: [name for name in names if not name.endswith(".prof")])
+
+        finally:
+            stop.set()
+            os.chdir(cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    stages = {
+        name: {**stage, "articles_per_sec": round(size / stage["wall_time"], 1) if stage["wall_time"] else None}
+        for name, stage in report["stages"].items()
+    }
+
+    return {
+        "benchmark": "extraction",
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "articles": size,
+        "options": {key: value for key, value in vars(options).items() if key not in ["sizes", "results"]},
+        "wall_time": round(wall_time, 3),
+        "articles_per_sec": round(size / wall_time, 1),
+        "stages": stages,
+        "api": report["api"],
+        "server": {"requests": server.requests, "errors": server.errors},
+        "throughput": samples,
+    }
+
+
+def wikitext_corpus(pages):
+    # Wikitext of the stand-in articles, in the middle of the text of a long article
+    server = StandInServer(articles=pages)
+    text = "Text of the article, with [[Link|links]], {{Template|param=value}} and <ref>references</ref>.\n" * 100
+
+    return [text + server.wikitext(f"Article {n} (target)") + text for n in range(pages)]
+
+
+def run_parser(size, options):
+    corpus = wikitext_corpus(size)
+
+    parsers = {
+        "legacy": lambda: [legacy_parse_images(page) for page in corpus],
+        "parse_images": lambda: [mediawiki_action_api.parse_images(page) for page in corpus],
+    }
+
+    if options.processes > 1:
+        def parse_in_processes():
+            with ProcessPoolExecutor(max_workers=options.processes) as parser:
+                return list(parser.map(mediawiki_action_api.parse_images, corpus, chunksize=10))
+
+        parsers[f"parse_images ({options.processes} processes)"] = parse_in_processes
+
+    timings = {}
+    images = {}
+    for name, parse in parsers.items():
+        start = time.perf_counter()
+        images[name] = sum(len(files) for files in parse())
+        timings[name] = time.perf_counter() - start
+
+    speedup = timings["legacy"] / timings["parse_images"]
+
+    return {
+        "benchmark": "parser",
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "pages": size,
+        "pages_per_sec": {name: round(size / seconds, 1) for name, seconds in timings.items()},
+        "images": images,
+        "speedup": round(speedup, 2),
+        # The single scan must stay faster than the previous parser
+        "passed": speedup > 1,
+    }
+
+
+@contextmanager
+def workspace():
+    # Temporary working directory, with the output folder of the synthetic projects
+    workdir = tempfile.mkdtemp(prefix="vcat_benchmark_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+
+    try:
+        os.makedirs("output/wp_Benchmark")
+        yield workdir
+
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def write_synthetic_project(articles, images_per_article=5, with_images=True):
+    # Datasets of an extracted project, with the articles and images of the stand-in server
+    server = StandInServer(articles=articles, images_per_article=images_per_article, image_pool=max(1, articles // 2))
+
+    df_articles = pd.DataFrame({
+        "article": [f"Article {n}" for n in range(articles)],
+        "article_link": [f"https://en.wikipedia.org/wiki/Article_{n}" for n in range(articles)],
+        "importance": [["Top", "High", "Mid", "Low"][n % 4] for n in range(articles)],
+        "quality": [["FA", "GA", "B", "C", "Start", "Stub"][n % 6] for n in range(articles)],
+    })
+
+    df_articles["categories"] = [f"Category {n % 100},Category {(n + 1) % 100}" for n in range(articles)]
+
+    # Projects before the images extraction have no images dataset
+    if not with_images:
+        storage.write_dataset(df_articles, "output/wp_Benchmark/wp_Benchmark")
+        return server
+
+    rows = [(f"Article {n}", title) for n in range(articles) for title in server.article_images(n)]
+    df_images = pd.DataFrame(rows, columns=["article", "title"])
+
+    df_articles["n_images"] = images_per_article
+
+    df_images["url"] = "https://upload.wikimedia.org/" + df_images["title"]
+    df_images["page url"] = "https://commons.wikimedia.org/wiki/" + df_images["title"]
+    df_images["thumbnail url"] = df_images["url"] + "/500px"
+    df_images["file_type"] = df_images["title"].str.rsplit(".", n=1).str[-1]
+    df_images["width"] = [100 + n % 4000 for n in range(len(df_images))]
+    df_images["height"] = df_images["width"] // 2
+    df_images["resolution"] = mediawiki_action_api.classify_resolution(df_images["width"], df_images["height"], df_images["file_type"])
+
+    storage.write_dataset(df_images, "output/wp_Benchmark/wp_Benchmark_images")
+    storage.write_dataset(df_articles, "output/wp_Benchmark/wp_Benchmark")
+
+    return server
+
+
+def run_json(size, options):
+    from extraction import build_json_output
+
+    # Projects of 5 images per article, the size is the number of images
+    storage.set_format("csv")
+    implementations = {"build_json_output": build_json_output}
+    if size <= options.baseline_max_size:
+        implementations["legacy"] = legacy_build_json_output
+
+    timings = {}
+    with workspace():
+        write_synthetic_project(max(1, size // 5))
+
+        for name, build in implementations.items():
+            start = time.perf_counter()
+            build("Benchmark", "wp")
+            timings[name] = time.perf_counter() - start
+
+    return {
+        "benchmark": "json",
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "images": size,
+        "wall_time": {name: round(seconds, 3) for name, seconds in timings.items()},
+        "images_per_sec": {name: round(size / seconds, 1) for name, seconds in timings.items()},
+    }
+
+
+def run_images(size, options):
+    import extraction
+
+    storage.set_format("csv")
+
+    timings = {}
+    images = {}
+
+    for name in ["extract_images", "legacy"]:
+        if name == "legacy" and size > options.baseline_max_size:
+            continue
+
+        with workspace():
+            server = write_synthetic_project(size, options.images_per_article, with_images=False)
+
+            # Images of the stand-in articles, without requests, to measure only the datasets' writing
+            def get_images(title, wiki=None):
+                return server.article_images(server.article_number(title))
+
+            start = time.perf_counter()
+
+            if name == "legacy":
+                legacy_extract_images("Benchmark", "wp", get_images, workers=options.workers)
+            else:
+                extraction.get_images, default_get_images = get_images, extraction.get_images
+                try:
+                    extraction.extract_images("Benchmark", "wp", workers=options.workers)
+                finally:
+                    extraction.get_images = default_get_images
+
+            timings[name] = time.perf_counter() - start
+            images[name] = len(storage.read_dataset("output/wp_Benchmark/wp_Benchmark_images"))
+
+    speedup = timings["legacy"] / timings["extract_images"] if "legacy" in timings else None
+
+    return {
+        "benchmark": "images",
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "articles": size,
+        "wall_time": {name: round(seconds, 3) for name, seconds in timings.items()},
+        "articles_per_sec": {name: round(size / seconds, 1) for name, seconds in timings.items()},
+        "images": images,
+        "speedup": round(speedup, 2) if speedup is not None else None,
+        # Both implementations must find the same images, and the new one must stay faster
+        "passed": len(set(images.values())) == 1 and (speedup is None or speedup > 1),
+    }
+
+
+def run_startup(size, options):
+    # Wall time of "import extraction_tool" in new interpreters, and its imports from -X importtime
+    wall_times = []
+    import_times = []
+    modules = set()
+
+    for _ in range(size):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-X", "importtime", "-c", "import extraction_tool"],
+                                   cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+        wall_times.append(time.perf_counter() - start)
+
+        # Lines "import time: self [us] | cumulative | imported package", nested imports are indented
+        import_time = 0
+        for line in completed.stderr.splitlines():
+            match = re.match(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$", line)
+            if match:
+                modules.add(match.group(4))
+                if not match.group(3):
+                    import_time += int(match.group(2)) / 10 ** 6
+        import_times.append(import_time)
+
+    lazy_imported = [module for module in STARTUP_LAZY_MODULES if module in modules]
+    wall_time = statistics.median(wall_times)
+
+    return {
+        "benchmark": "startup",
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "runs": size,
+        "wall_time": {"min": round(min(wall_times), 3), "median": round(wall_time, 3)},
+        "import_time": round(statistics.median(import_times), 3),
+        "lazy_imported": lazy_imported,
+        "passed": not lazy_imported and wall_time <= options.max_startup_time,
+    }
+
+
+def check_json_scaling(results):
+    # The time per image of the largest project must stay close to the one of the smallest project
+    smallest = min(results, key=lambda result: result["images"])
+    largest = max(results, key=lambda result: result["images"])
+    ratio = smallest["images_per_sec"]["build_json_output"] / largest["images_per_sec"]["build_json_output"]
+
+    for result in results:
+        result["scaling"] = round(ratio, 2)
+        result["passed"] = ratio <= 2
+
+    print(f'  time per image, {largest["images"]} vs {smallest["images"]} images: {ratio:.2f}x')
+
+
+def main(args=None):
+    options = parse_args(sys.argv[1:] if args is None else args)
+
+    results = []
+    for size in options.sizes:
+        if options.benchmark == "extraction":
+            print(f"\nBenchmark with {size} articles...")
+            result = run(size, options)
+
+            print(f'{result["wall_time"]:.1f}s, {result["articles_per_sec"]} articles/s, {result["server"]["requests"]} requests')
+            for name, stage in result["stages"].items():
+                print(f'  {name:<12}{stage["wall_time"]:>10.2f}s{stage["requests"]:>10} requests')
+
+        elif options.benchmark == "parser":
+            print(f"\nParser benchmark with {size} pages...")
+            result = run_parser(size, options)
+
+            for name, pages_per_sec in result["pages_per_sec"].items():
+                print(f'  {name:<32}{pages_per_sec:>12} pages/s{result["images"][name]:>12} images')
+            print(f'  speedup {result["speedup"]}x')
+
+        elif options.benchmark == "json":
+            print(f"\nJSON output benchmark with {size} images...")
+            result = run_json(size, options)
+
+            for name, seconds in result["wall_time"].items():
+                print(f'  {name:<32}{seconds:>10.2f}s{result["images_per_sec"][name]:>14} images/s')
+
+        elif options.benchmark == "images":
+            print(f"\nImages extraction benchmark with {size} articles...")
+            result = run_images(size, options)
+
+            for name, seconds in result["wall_time"].items():
+                print(f'  {name:<32}{seconds:>10.2f}s{result["articles_per_sec"][name]:>14} articles/s{result["images"][name]:>10} images')
+            if result["speedup"] is not None:
+                print(f'  speedup {result["speedup"]}x')
+
+        elif options.benchmark == "startup":
+            print(f"\nStartup benchmark of the tool, {size} runs...")
+            result = run_startup(size, options)
+
+            print(f'  {result["wall_time"]["median"]:.3f}s median wall time, {result["import_time"]:.3f}s importing')
+            if result["lazy_imported"]:
+                print(f'  imported at startup: {", ".join(result["lazy_imported"])}')
+
+        results.append(result)
+
+    if options.benchmark == "json":
+        check_json_scaling(results)
+
+    # Results are appended, to follow the throughput over time
+    history = []
+    if os.path.exists(options.results):
+        with open(options.results) as infile:
+            history = json.load(infile)
+
+    with open(options.results, "w") as outfile:
+        json.dump(history + results, outfile, indent=2)
+
+    print(f'\nResults saved to "{options.results}"')
+
+    # Regressions of the benchmarks with a baseline
+    failed = [size for size, result in zip(options.sizes, results) if result.get("passed") is False]
+    for size in failed:
+        print(f"Regression: {options.benchmark} benchmark, size {size}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+from datetime import datetime
+from tqdm import tqdm
+import pandas as pd
+import numpy as np
+import json
+import os
+import re
+
+
+# Implementations replaced by the optimizations of the extraction, kept as the baselines of benchmark.py.
+# They are copies of the previous code, only detached from the network.
+
+
+def legacy_parse_images(data):
+    # Images of the wikitext, as found by get_images before the single precompiled scan
+    file_types = [".svg", ".png", ".jpg", ".jpeg", ".gif"]
+    files = []
+
+    for f_type in file_types:
+        re_string = "=.*?" + f_type + "|:.*?" + f_type
+        files += re.findall(re_string, data, re.IGNORECASE)
+
+    for i in range(len(files)):
+        if "File" in files[i]:
+            files[i] = files[i].split("File")[1]
+        if "[[Image" in files[i]:
+            files[i] = files[i].split("[[Image")[1]
+        if "[[file" in files[i]:
+            files[i] = files[i].split("[[file")[1]
+        if "|image" in files[i]:
+            files[i] = files[i].split("|image")[1]
+        if "|" in files[i]:
+            files[i] = files[i].split("|")[0]
+
+    files = ["File:" + f[1:].strip() for f in files]
+    files = [unquote(f) for f in files]
+
+    for f in files[:]:
+        if "/" in f:
+            files.remove(f)
+        elif not any(f_type in f.lower() for f_type in file_types):
+            files.remove(f)
+
+    return files
+
+
+def legacy_build_json_output(project_name, project_type):
+    # JSON output as written before the single index of images by article, from the CSV datasets
+    articles_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}.csv'
+    df_articles = pd.read_csv(articles_path)
+
+    images_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}_images.csv'
+    df_images = pd.read_csv(images_path)
+
+    # Object columns, as read by the pandas versions of that code, so that lists can be stored in the cells
+    df_articles["categories"] = df_articles["categories"].astype(object)
+    df_articles["images"] = pd.Series("", index=df_articles.index, dtype=object)
+
+    # Convert categories list to array
+    for index, row in df_articles.iterrows():
+
+        categories = str(row["categories"]).split(",")
+        df_articles.at[index, 'categories'] = categories
+
+        images = json.loads(df_images.loc[df_images['article'] == row["article"]].to_json(orient='records'))
+        df_articles.at[index, 'images'] = images
+
+    # Convert Dataframe to JSON
+    json_articles = json.loads(df_articles.to_json(orient='records'))
+
+    # Create info json
+    date = datetime.today().strftime('%Y-%m-%d')
+    project = "List"
+    if project_type == "wp":
+        project = "Wikiproject"
+    project = f"{project} {project_name}"
+
+    info = {"name": project, "date": date}
+
+    # Merge json
+    json_output = {
+        "info": info,
+        "data": json_articles
+    }
+
+    with open(f'output/{project_type}_{project_name}/{project_type}_{project_name}.json', 'w') as outfile:
+        json.dump(json_output, outfile)
+
+
+def legacy_extract_images(project_name, project_type, get_images, workers=1):
+    # Images extraction as done before the append-only datasets, growing and rewriting the frames.
+    # get_images is a parameter, instead of the function of the API module
+    articles_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}.csv'
+    images_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}_images.csv'
+
+    # Load list of pages
+    df = pd.read_csv(articles_path)
+    if "n_images" not in df:
+        df["n_images"] = np.nan
+
+    # Create, if not existing, and load images dataset
+    if not os.path.exists(images_path):
+        df_images = pd.DataFrame(columns=['article', 'title', 'url', 'page url', 'thumbnail url', 'file_type', 'width', 'height', "resolution"])
+        df_images.to_csv(images_path, index=False, encoding='utf-8-sig')
+    else:
+        df_images = pd.read_csv(images_path)
+
+    print("\nIMAGES EXTRACTION")
+    pbar = tqdm(total=len(df))
+
+    # Articles already processed in a previous run are skipped
+    pending = df.index[df["n_images"].isna()].tolist()
+    pbar.update(len(df) - len(pending))
+
+    # Fetch wikitext concurrently, one chunk at a time, so that a checkpoint is saved after every chunk
+    size = 100
+    pending_split = [pending[x:x + size] for x in range(0, len(pending), size)]
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for chunk in pending_split:
+            # Results are consumed in article order to keep the same output of the serial extraction
+            chunk_images = executor.map(get_images, df.loc[chunk, "article"].tolist())
+
+            for index, images in zip(chunk, chunk_images):
+                df.at[index, 'n_images'] = len(images)
+
+                temp_images = pd.DataFrame({
+                    "article": df.at[index, "article"],
+                    "title": images
+                })
+
+                df_images = pd.concat([df_images, temp_images]).reset_index(drop=True)
+
+                pbar.update(1)
+
+            df.to_csv(articles_path, index=False, encoding='utf-8-sig')
+            df_images.to_csv(images_path, index=False, encoding='utf-8-sig')
+
+    df.to_csv(articles_path, index=False, encoding='utf-8-sig')
+    df_images.to_csv(images_path, index=False, encoding='utf-8-sig')
+    pbar.close()
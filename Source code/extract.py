@@ -0,0 +1,147 @@
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import shutil
+import time
+import sys
+import os
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog="extract",
+        description="Extract the data of Wikiprojects and custom lists without the interactive menu."
+    )
+    parser.add_argument("--wp", action="append", default=[], metavar="NAME",
+                        help="Wikiproject to extract (case sensitive), can be repeated")
+    parser.add_argument("--list", action="append", default=[], metavar="NAME[@WIKI]",
+                        help='Custom list to extract, from "input/NAME.csv", can be repeated. '
+                             'The articles are on WIKI, when given (e.g. "Painters@it.wikipedia.org")')
+    parser.add_argument("--wiki", default="en.wikipedia.org",
+                        help="Wiki of the custom lists without @WIKI (default: en.wikipedia.org)")
+    parser.add_argument("--jobs", type=int, default=2,
+                        help="Projects extracted in parallel, one process each (default: 2)")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Concurrent requests of each project (default: 4)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Processes parsing the wikitext of each project, with more than 100 articles to extract (default: 1)")
+    parser.add_argument("--discovery", choices=["wikitext", "api"], default="wikitext",
+                        help="How images are found in the articles (default: wikitext)")
+    parser.add_argument("--storage", choices=["csv", "parquet"], default="csv",
+                        help="Format of the working datasets (default: csv)")
+    parser.add_argument("--export-csv", action="store_true",
+                        help="Also write CSV copies of the Parquet datasets at the end of the extraction")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Overlap the categories, images and images' data extraction")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Extract again only the articles changed since the last extraction")
+    parser.add_argument("--ttl", type=float, metavar="DAYS",
+                        help="Request again the images' data cached more than DAYS ago (default: never)")
+    parser.add_argument("--output", choices=["json", "shards"], default="json",
+                        help="A single JSON file, or shards of articles with a manifest for lazy loading (default: json)")
+    parser.add_argument("--shard-size", type=int, default=1000,
+                        help="Articles of each shard (default: 1000)")
+    parser.add_argument("--group-by", choices=["quality", "importance"],
+                        help="Store the articles of the same quality or importance in their own shards")
+    parser.add_argument("--download-images", action="store_true",
+                        help='Download the thumbnails of the images to "output/images"')
+    parser.add_argument("--profile", action="store_true",
+                        help="Save a cProfile of every stage in the project output folder")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Measure the peak memory of every stage, in run_report.json (slows down the extraction)")
+    parser.add_argument("--fresh", action="store_true",
+                        help="Delete existing files instead of filling the missing data")
+
+    parsed = parser.parse_args(args)
+
+    if not parsed.wp and not parsed.list:
+        parser.error("at least one --wp or --list is required")
+
+    if parsed.shard_size < 1:
+        parser.error("--shard-size must be at least 1")
+
+    # Wikiprojects are assessed on the English Wikipedia
+    parsed.projects = [(wp.replace(" ", "_"), "wp", "en.wikipedia.org") for wp in parsed.wp]
+
+    for list_arg in parsed.list:
+        list_name, _, wiki = list_arg.partition("@")
+        if not os.path.exists(f"input/{list_name}.csv"):
+            parser.error(f'"input/{list_name}.csv" does not exist')
+        parsed.projects.append((list_name, "list", wiki or parsed.wiki))
+
+    # Projects of different wikis are extracted concurrently, but each one has a single output folder
+    names = [(project_name, project_type) for project_name, project_type, wiki in parsed.projects]
+    for project_name, project_type in set(names):
+        if names.count((project_name, project_type)) > 1:
+            parser.error(f'"{project_type}_{project_name}" is requested more than once')
+
+    return parsed
+
+
+def share_rate_limits(jobs):
+    # Every process has its own HTTP client, the limits of each host are split between the processes
+    import http_client
+
+    http_client.RATE = http_client.RATE / jobs
+    http_client.BURST = max(1, http_client.BURST / jobs)
+    http_client.MAX_CONCURRENCY = max(1, http_client.MAX_CONCURRENCY // jobs)
+    http_client.MIN_CONCURRENCY = min(http_client.MIN_CONCURRENCY, http_client.MAX_CONCURRENCY)
+
+
+def run_project(project_name, project_type, wiki, options):
+    # Imported in the worker, so that every process has its own HTTP client
+    from extraction import full_extraction, download_images
+
+    start = time.time()
+    output_path = f"output/{project_type}_{project_name}"
+
+    try:
+        if options.fresh and os.path.exists(output_path):
+            shutil.rmtree(output_path)
+
+        os.makedirs(output_path, exist_ok=True)
+
+        full_extraction(project_name=project_name, project_type=project_type, workers=options.workers, processes=options.processes,
+                        discovery=options.discovery, storage=options.storage, pipeline=options.pipeline,
+                        refresh=options.refresh, profile=options.profile, trace_memory=options.trace_memory, wiki=wiki, output=options.output,
+                        shard_size=options.shard_size, group_by=options.group_by, csv_export=options.export_csv,
+                        ttl=options.ttl * 24 * 60 * 60 if options.ttl is not None else None)
+
+        if options.download_images:
+            download_images(project_name=project_name, project_type=project_type, workers=options.workers)
+
+        return {"project": output_path, "status": "ok", "time": time.time() - start, "error": ""}
+
+    except Exception as e:
+        return {"project": output_path, "status": "failed", "time": time.time() - start, "error": repr(e)}
+
+
+def main(args=None):
+    options = parse_args(sys.argv[1:] if args is None else args)
+
+    os.makedirs("output", exist_ok=True)
+
+    projects = options.projects
+
+    jobs = max(1, min(options.jobs, len(projects)))
+
+    # Progress bars of parallel projects would overlap
+    if jobs > 1:
+        os.environ["TQDM_DISABLE"] = "1"
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=share_rate_limits, initargs=(jobs,)) as executor:
+        futures = [executor.submit(run_project, project_name, project_type, wiki, options) for project_name, project_type, wiki in projects]
+        results = [future.result() for future in futures]
+
+    # Summary of the extraction
+    print("\n")
+    for result in results:
+        print(f'{result["status"]:<8}{result["time"]:>10.1f}s  {result["project"]}  {result["error"]}')
+
+    failed = [result for result in results if result["status"] != "ok"]
+    print(f"\n{len(results) - len(failed)} of {len(results)} projects extracted")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
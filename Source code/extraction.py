@@ -1,48 +1,179 @@
-import requests
 import pandas as pd
 from tqdm import tqdm
 import numpy as np
-from mediawiki_action_api import get_images, get_image_info, get_categories, get_assessment
+from mediawiki_action_api import get_images, get_wikitext, parse_images, file_prefixes, get_pages_images, get_image_info, get_categories, get_assessments, get_revisions, DEFAULT_WIKI, COMMONS_WIKI
+from http_client import client, decode_json
+from wikiprojects import extract_wikiprojects_list, check_connection
+import wikiprojects
+from image_cache import get_cached_image_info, get_image_hosts, save_image_info
+from storage import read_dataset, write_dataset, append_dataset, dataset_exists, remove_dataset, replace_dataset, export_csv, set_format
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from urllib.parse import urlparse
+import instrumentation
+import tracemalloc
+import threading
+import shutil
+import gzip
+import queue
+import time
 import os
 import re
 import json
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
-def full_extraction(project_name, project_type):
-    if project_type == "wp":
-        extract_wikiproject_articles(project_name)
 
-    if project_type == "list":
-        extract_list_articles(project_name)
+materialize_lock = threading.Lock()
 
-    extract_categories(project_name, project_type)
-    extract_images(project_name, project_type)
-    extract_images_data(project_name, project_type)
-    build_json_output(project_name, project_type)
+# Groups of the sharded output, articles of different groups are never in the same shard
+SHARD_GROUPS = [None, "quality", "importance"]
 
+# Compression of the precompressed shards, the slowest levels, done once per extraction
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
 
-def build_json_output(project_name, project_type):
-    # Load articles to Dataframe
-    articles_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}.csv'
-    df_articles = pd.read_csv(articles_path)
 
-    images_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}_images.csv'
-    df_images = pd.read_csv(images_path)
+def full_extraction(project_name, project_type, workers=4, processes=1, discovery="wikitext", storage="csv", pipeline=False, refresh=False,
+                    profile=False, trace_memory=False, wiki=None, output="json", shard_size=1000, group_by=None, ttl=None,
+                    csv_export=False):
+    set_format(storage)
 
-    df_articles["images"] = ""
+    output_path = f'output/{project_type}_{project_name}'
+
+    # Metrics of the run, written to run_report.json
+    instrumentation.reset()
+    client.reset_report()
+    if trace_memory:
+        tracemalloc.start()
+
+    def stage(name):
+        profile_path = f'{output_path}/profile_{name}.prof' if profile else None
+        return instrumentation.stage(name, profile_path)
+
+    start = time.time()
+
+    try:
+        with stage("articles"):
+            if project_type == "wp":
+                extract_wikiproject_articles(project_name, workers=workers)
+
+            if project_type == "list":
+                extract_list_articles(project_name, wiki=wiki)
+
+        if refresh:
+            with stage("refresh"):
+                refresh_changed_articles(project_name, project_type, wiki=wiki)
+
+        if pipeline:
+            with stage("pipeline"):
+                pipelined_extraction(project_name, project_type, workers=workers, processes=processes, discovery=discovery, wiki=wiki, ttl=ttl)
+        else:
+            with stage("categories"):
+                extract_categories(project_name, project_type, wiki=wiki)
+            with stage("images"):
+                extract_images(project_name, project_type, workers=workers, processes=processes, discovery=discovery, wiki=wiki)
+
+        with stage("images_data"):
+            extract_images_data(project_name, project_type, ttl=ttl, wiki=wiki)
+        with stage("json"):
+            if output == "shards":
+                build_sharded_output(project_name, project_type, shard_size=shard_size, group_by=group_by)
+            else:
+                build_json_output(project_name, project_type)
+
+        # CSV datasets are already CSV files
+        if csv_export and storage != "csv":
+            with stage("export_csv"):
+                export_project_csv(project_name, project_type)
+
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+        report = client.report()
+        instrumentation.write_report(f'{output_path}/run_report.json', {
+            "project": f'{project_type}_{project_name}',
+            "wall_time": round(time.time() - start, 3),
+            "options": {"workers": workers, "processes": processes, "discovery": discovery, "storage": storage, "pipeline": pipeline, "refresh": refresh,
+                        "wiki": wiki or DEFAULT_WIKI, "output": output, "ttl": ttl, "csv_export": csv_export},
+            "throttling": report,
+        })
+
+    print(f"\nTime spent throttled: {report['throttled_time']}s ({report['retries']} retries)")
 
-    # Convert categories list to array
-    for index, row in df_articles.iterrows():
 
-        categories = str(row["categories"]).split(",")
-        df_articles.at[index, 'categories'] = categories
+def pipelined_extraction(project_name, project_type, workers=4, processes=1, discovery="wikitext", queue_size=1000, wiki=None, ttl=None):
+    # Image titles flow from the images extraction to the images' data extraction
+    titles_queue = queue.Queue(maxsize=queue_size)
+
+    def resolve_images():
+        resolved = set()
+        sect = []
+        title = ""
+
+        try:
+            while True:
+                title = titles_queue.get()
+
+                if title is not None and title not in resolved:
+                    resolved.add(title)
+                    sect.append(title)
+
+                if len(sect) >= 50 or (title is None and sect):
+                    # Images info is stored in the cache, extract_images_data merges it at the end
+                    cached = get_cached_image_info(sect, ttl, wiki)
+                    sect = [img for img in sect if img not in cached]
+                    for host, host_sect in split_by_host(sect, wiki).items():
+                        save_image_info(get_image_info(host_sect, host))
+                    sect = []
+
+                if title is None:
+                    break
+
+        except Exception:
+            # Keep consuming the queue, so that the images extraction is never blocked,
+            # unless the end of the queue was already reached
+            while title is not None:
+                title = titles_queue.get()
+            raise
+
+    def queue_images(titles):
+        for title in titles:
+            titles_queue.put(title)
+
+    # Categories and images' data are extracted while the images are discovered
+    with ThreadPoolExecutor(max_workers=2) as stages:
+        categories = stages.submit(extract_categories, project_name, project_type, wiki=wiki)
+        resolver = stages.submit(resolve_images)
 
-        images = json.loads(df_images.loc[df_images['article'] == row["article"]].to_json(orient='records'))
-        df_articles.at[index, 'images'] = images
+        try:
+            extract_images(project_name, project_type, workers=workers, processes=processes, discovery=discovery, on_images=queue_images, wiki=wiki)
+        finally:
+            titles_queue.put(None)
+
+        categories.result()
+        resolver.result()
+
+
+def load_output_datasets(project_name, project_type):
+    # Load articles to Dataframe
+    articles_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}'
+    df_articles = read_dataset(articles_path)
 
-    # Convert Dataframe to JSON
-    json_articles = json.loads(df_articles.to_json(orient='records'))
+    images_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}_images'
+    df_images = read_dataset(images_path)
+
+    # Convert categories list to array
+    df_articles["categories"] = df_articles["categories"].astype(str).str.split(",")
+
+    # Revisions are only used to refresh the changed articles
+    df_articles = df_articles.drop(columns=["lastrevid"], errors="ignore")
 
     # Create info json
     date = datetime.today().strftime('%Y-%m-%d')
@@ -53,22 +184,196 @@ def build_json_output(project_name, project_type):
 
     info = {"name": project, "date": date}
 
-    # Merge json
-    json_output = {
+    return df_articles, df_images, info
+
+
+def iter_json_articles(df_articles, df_images, chunk_size=1000):
+    # Positions of the images of each article, with a single pass over the images dataset
+    images_positions = df_images.groupby("article", sort=False).indices
+    no_images = np.array([], dtype=int)
+
+    for start in range(0, len(df_articles), chunk_size):
+        df_chunk = df_articles.iloc[start:start + chunk_size]
+
+        # Convert the chunk and its images to JSON
+        positions = [images_positions.get(article, no_images) for article in df_chunk["article"]]
+        json_images = json.loads(df_images.iloc[np.concatenate(positions)].to_json(orient='records'))
+        json_articles = json.loads(df_chunk.to_json(orient='records'))
+
+        offset = 0
+        for article, article_positions in zip(json_articles, positions):
+            article["images"] = json_images[offset:offset + len(article_positions)]
+            offset += len(article_positions)
+
+            yield article
+
+
+def build_json_output(project_name, project_type, chunk_size=1000):
+    df_articles, df_images, info = load_output_datasets(project_name, project_type)
+
+    # Inverted index of the categories (category -> positions of its articles in "data"),
+    # and counts of articles and images by category, quality and importance
+    categories_index = {}
+    stats = {"category": {}, "quality": {}, "importance": {}}
+
+    # Write the articles as json.dump({"info": info, "data": articles}) would, one chunk of articles at a time,
+    # followed by the index and the stats, built in the same pass
+    with open(f'output/{project_type}_{project_name}/{project_type}_{project_name}.json', 'w') as outfile:
+        outfile.write('{"info": ' + json.dumps(info) + ', "data": [')
+
+        for article_id, article in enumerate(iter_json_articles(df_articles, df_images, chunk_size)):
+            if article_id > 0:
+                outfile.write(', ')
+            outfile.write(json.dumps(article))
+
+            add_article_stats(article_id, article, categories_index, stats)
+
+        outfile.write('], "categories": ' + json.dumps(categories_index) + ', "stats": ' + json.dumps(stats) + '}')
+
+
+def build_sharded_output(project_name, project_type, shard_size=1000, group_by=None, chunk_size=1000):
+    if group_by not in SHARD_GROUPS:
+        raise ValueError(f'Invalid shards grouping "{group_by}", use one of {SHARD_GROUPS}')
+
+    df_articles, df_images, info = load_output_datasets(project_name, project_type)
+
+    # Articles of the same group are stored next to each other, in the order of the dataset
+    if group_by is not None:
+        groups = df_articles[group_by].astype(object).fillna("").astype(str)
+        codes = pd.Categorical(groups, categories=groups.unique()).codes
+        order = np.argsort(codes, kind="stable")
+
+        df_articles = df_articles.iloc[order].reset_index(drop=True)
+        groups = groups.iloc[order].tolist()
+    else:
+        groups = [None] * len(df_articles)
+
+    shards_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}_shards'
+
+    # Shards are written to a temporary folder, renamed only when complete
+    part_path = f'{shards_path}.part'
+    shutil.rmtree(part_path, ignore_errors=True)
+    os.makedirs(part_path)
+
+    # Articles are identified by their position in the shards, also in the index
+    categories_index = {}
+    stats = {"category": {}, "quality": {}, "importance": {}}
+
+    shards = []
+    shard = []
+
+    for article_id, (article, group) in enumerate(zip(iter_json_articles(df_articles, df_images, chunk_size), groups)):
+        # A shard never spans two groups
+        if shard and (len(shard) >= shard_size or group != shard_group):
+            shards.append(write_shard(part_path, len(shards), shard_start, shard_group, shard))
+            shard = []
+
+        if not shard:
+            shard_start = article_id
+            shard_group = group
+
+        shard.append(article)
+
+        add_article_stats(article_id, article, categories_index, stats)
+
+    if shard:
+        shards.append(write_shard(part_path, len(shards), shard_start, shard_group, shard))
+
+    index_sizes = write_precompressed(f'{part_path}/index.json', {"categories": categories_index, "stats": stats})
+
+    # Small description of the shards, the first file loaded by the frontend
+    manifest = {
         "info": info,
-        "data": json_articles
+        "articles": len(df_articles),
+        "images": sum(shard["images"] for shard in shards),
+        "shard_size": shard_size,
+        "group_by": group_by,
+        "encodings": ["gzip"] + (["br"] if brotli is not None else []),
+        "index": {"file": "index.json", "bytes": index_sizes},
+        "shards": shards,
     }
 
-    with open(f'output/{project_type}_{project_name}/{project_type}_{project_name}.json', 'w') as outfile:
-        json.dump(json_output, outfile)
-        outfile.close()
+    with open(f'{part_path}/manifest.json', 'w') as outfile:
+        json.dump(manifest, outfile, indent=2)
+
+    shutil.rmtree(shards_path, ignore_errors=True)
+    os.replace(part_path, shards_path)
+
+    print(f"\n{len(shards)} shards written to {shards_path}")
+
+
+def write_shard(path, number, start, group, articles):
+    name = "part" if group is None else (re.sub(r"[^\w-]", "_", group) or "none")
+    filename = f"{name}_{number:05d}.json"
+
+    sizes = write_precompressed(f"{path}/{filename}", {"start": start, "data": articles})
+
+    return {
+        "file": filename,
+        "group": group,
+        "start": start,
+        "end": start + len(articles),
+        "articles": len(articles),
+        "images": sum(len(article["images"]) for article in articles),
+        "bytes": sizes,
+    }
 
 
-def extract_wikiproject_articles(wikiproject_id):
+def precompress(data):
+    # Variants served as they are, with Content-Encoding, by the web server
+    variants = {"gzip": (".gz", gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0))}
+
+    if brotli is not None:
+        variants["br"] = (".br", brotli.compress(data, quality=BROTLI_QUALITY))
+
+    return variants
+
+
+def write_precompressed(path, content):
+    data = json.dumps(content).encode("utf-8")
+
+    with open(path, "wb") as outfile:
+        outfile.write(data)
+    sizes = {"identity": len(data)}
+
+    for encoding, (extension, compressed) in precompress(data).items():
+        with open(f"{path}{extension}", "wb") as outfile:
+            outfile.write(compressed)
+        sizes[encoding] = len(compressed)
+
+    return sizes
+
+
+def add_article_stats(article_id, article, categories_index, stats):
+    categories = list(dict.fromkeys(article["categories"]))
+    for category in categories:
+        categories_index.setdefault(category, []).append(article_id)
+
+    groups = [("category", category) for category in categories]
+    groups += [("quality", article["quality"]), ("importance", article["importance"])]
+
+    for group, key in groups:
+        group_stats = stats[group].setdefault("" if key is None else str(key), {
+            "articles": 0,
+            "images": 0,
+            "resolution": {},
+            "file_type": {},
+        })
+
+        group_stats["articles"] += 1
+        group_stats["images"] += len(article["images"])
+
+        for image in article["images"]:
+            for column in ["resolution", "file_type"]:
+                value = "" if image[column] is None else str(image[column])
+                group_stats[column][value] = group_stats[column].get(value, 0) + 1
+
+
+def extract_wikiproject_articles(wikiproject_id, workers=1):
     print("\nARTICLES EXTRACTION")
 
     # Skip function if the file already exists
-    if os.path.exists(f"output/wp_{wikiproject_id}/wp_{wikiproject_id}.csv"):
+    if dataset_exists(f"output/wp_{wikiproject_id}/wp_{wikiproject_id}"):
         pbar = tqdm(total=1)
         pbar.update(1)
         pbar.close()
@@ -96,290 +401,484 @@ def extract_wikiproject_articles(wikiproject_id):
     ]
 
 
-    url = f'https://api.wp1.openzim.org/v1/projects/{wikiproject_id}/articles'
+    url = f'{wikiprojects.WP1_URL}/{wikiproject_id}/articles'
 
-    first_params = {
-        "numRows": 500,
-        "page": 1
-    }
-
-    session = requests.Session()
-
-    page_number = 0
-    df_tot = pd.DataFrame({'A': []})
+    articles_path = f'output/wp_{wikiproject_id}/wp_{wikiproject_id}'
 
-    r = session.get(url=url, params=first_params)
-    data = r.json()
-    tot_pages = data["pagination"]["total_pages"]
-    tot_articles = data["pagination"]["total"]
-
-    pbar = tqdm(total=tot_articles)
-
-    while True:
-        page_number += 1
+    # Articles are streamed to a temporary dataset, renamed only when the extraction is complete
+    part_path = f'{articles_path}.part'
+    remove_dataset(part_path)
 
+    def get_articles_page(page_number):
         params = {
             "numRows": 500,
             "page": page_number
         }
 
-        r = session.get(url=url, params=params)
-        data = r.json()
+        r = client.get(url=url, params=params)
+        return decode_json(r)
 
-        tot_pages = data["pagination"]["total_pages"]
+    def save_articles_page(data):
+        df = pd.DataFrame(data["articles"])
+        if df.empty:
+            return
 
-        pbar.update(len(data["articles"]))
+        # Remove "-Class" from importance and quality
+        df['quality'] = df['quality'].str.replace('-Class', '')
+        df['importance'] = df['importance'].str.replace('-Class', '')
 
-        df = pd.DataFrame(data["articles"])
-        if df_tot.empty:
-            df_tot = df
-        else:
-            df_tot = pd.concat([df_tot, df])
+        # Filter not necessary pages (categories, redirects, etc.)
+        df = df[df["quality"].isin(quality_grades)].reset_index(drop=True)
 
-        if page_number >= tot_pages:
-            break
+        df['importance'] = df['importance'].apply(lambda x: x if x in importance_grades else "Unknown")
 
-    pbar.close()
+        # Drop not necessary columns
+        df = df.drop(['article_history_link', 'article_talk', 'article_talk_link', 'quality_updated', 'importance_updated'], axis=1)
 
-    # Remove "-Class" from importance and quality
-    df_tot['quality'] = df_tot['quality'].str.replace('-Class', '')
-    df_tot['importance'] = df_tot['importance'].str.replace('-Class', '')
+        # Append the page to the output file
+        append_dataset(df, part_path)
 
-    # Filter not necessary pages (categories, redirects, etc.)
-    df_tot = df_tot[df_tot["quality"].isin(quality_grades)].reset_index(drop=True)
+    # The first page also gives the size of the Wikiproject
+    data = get_articles_page(1)
+    tot_pages = data["pagination"]["total_pages"]
+    tot_articles = data["pagination"]["total"]
 
-    # df_tot.loc[df_tot["importance"] not in importance_grades, "importance"] = "Unknown"
-    # df_tot["importance"] = np.where(df_tot["importance"] in importance_grades, "Unknown", df_tot["importance"])
-    df_tot['importance'] = df_tot['importance'].apply(lambda x: x if x in importance_grades else "Unknown")
+    pbar = tqdm(total=tot_articles)
 
-    # Drop not necessary columns
-    df_tot.drop(['article_history_link', 'article_talk', 'article_talk_link', 'quality_updated', 'importance_updated'], axis=1, inplace=True)
+    save_articles_page(data)
+    pbar.update(len(data["articles"]))
 
-    # Save the dataframe as CSV
-    df_tot.to_csv(f'output/wp_{wikiproject_id}/wp_{wikiproject_id}.csv', index=False, encoding='utf-8-sig')
+    # Fetch the remaining pages concurrently, a window at a time to keep the memory bounded
+    remaining_pages = list(range(2, tot_pages + 1))
+    size = max(1, workers) * 2
+    pages_split = [remaining_pages[x:x + size] for x in range(0, len(remaining_pages), size)]
 
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for pages in pages_split:
+            # Pages are saved in order, as they arrive
+            for data in executor.map(get_articles_page, pages):
+                save_articles_page(data)
+                pbar.update(len(data["articles"]))
 
-def extract_list_articles(list_name):
+    pbar.close()
+
+    if not dataset_exists(part_path):
+        write_dataset(pd.DataFrame(columns=["article", "article_link", "importance", "quality"]), part_path)
+
+    replace_dataset(part_path, articles_path)
+
+
+def extract_list_articles(list_name, wiki=None):
     print("\nASSESSMENT EXTRACTION")
 
-    articles_path = f'output/list_{list_name}/list_{list_name}.csv'
+    articles_path = f'output/list_{list_name}/list_{list_name}'
 
     # Load list of articles
     article_list = pd.read_csv(f'input/{list_name}.csv').iloc[:, 0].tolist()
 
     # Check if file already exists
-    if os.path.exists(articles_path):
-        df = pd.read_csv(articles_path)
+    if dataset_exists(articles_path):
+        df = read_dataset(articles_path).astype({"article_link": object, "quality": object, "importance": object})
     else:
+        # Object columns, so that the assessments can be stored in the cells
+        index = pd.RangeIndex(len(article_list))
         df = pd.DataFrame({
             "article": article_list,
-            "article_link": np.nan,
-            "importance": np.nan,
-            "quality": np.nan,
+            "article_link": pd.Series(np.nan, index=index, dtype=object),
+            "importance": pd.Series(np.nan, index=index, dtype=object),
+            "quality": pd.Series(np.nan, index=index, dtype=object),
         })
-        df.to_csv(articles_path, index=False, encoding='utf-8-sig')
+        write_dataset(df, articles_path)
 
     pbar = tqdm(total=len(article_list))
 
-    for index, row in df.iterrows():
-        if pd.isna(row["article_link"]):
-            article_info = get_assessment(row["article"])
+    # Articles already assessed in a previous run are skipped
+    pending = df.index[df["article_link"].isna()].tolist()
+    pbar.update(len(df) - len(pending))
+
+    # Assessments are requested for 50 articles at a time
+    size = 50
+    pending_split = [pending[x:x + size] for x in range(0, len(pending), size)]
+    unsaved = 0
+
+    for chunk in pending_split:
+        articles_info = get_assessments(df.loc[chunk, "article"].astype(str).tolist(), wiki=wiki)
+
+        for index in chunk:
+            article_info = articles_info.get(str(df.at[index, "article"]), {"url": "", "quality": "", "importance": ""})
 
             df.at[index, 'article_link'] = article_info["url"]
             df.at[index, 'quality'] = str(article_info["quality"]).replace('-Class', '')
             df.at[index, 'importance'] = str(article_info["importance"]).replace('-Class', '')
 
-            if index % 100 == 0:
-                df.to_csv(articles_path, index=False, encoding='utf-8-sig')
+        pbar.update(len(chunk))
 
-        pbar.update(1)
+        # Save a checkpoint every 100 articles
+        unsaved += len(chunk)
+        if unsaved >= 100:
+            write_dataset(df, articles_path)
+            unsaved = 0
 
-    df.to_csv(articles_path, index=False, encoding='utf-8-sig')
+    write_dataset(df, articles_path)
     pbar.close()
 
 
-def extract_categories(project_name, project_type):
-    articles_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}.csv'
+def refresh_changed_articles(project_name, project_type, wiki=None):
+    articles_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}'
+    images_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}_images'
+
+    print("\nCHANGED ARTICLES")
+
+    df = read_dataset(articles_path).astype({"quality": object, "importance": object})
+
+    for column in ["categories", "n_images", "lastrevid"]:
+        if column not in df:
+            df[column] = np.nan
+
+    # Compare the latest revisions with the ones of the last extraction, 50 articles per request
+    articles = df["article"].astype(str)
+    revisions = get_revisions(articles.tolist(), wiki)
+
+    current = pd.to_numeric(articles.map(revisions), errors="coerce")
+    changed = current.notna() & (current != pd.to_numeric(df["lastrevid"], errors="coerce"))
+
+    print(f"{changed.sum()} of {len(df)} articles changed")
+
+    if not changed.any():
+        return
+
+    # Assessment of the changed articles
+    project = project_name.replace("_", " ") if project_type == "wp" else None
+    articles_info = get_assessments(articles[changed].tolist(), project, wiki)
+
+    for index in df.index[changed]:
+        if articles[index] not in articles_info:
+            continue
+
+        article_info = articles_info[articles[index]]
+
+        quality = str(article_info["quality"]).replace('-Class', '')
+        importance = str(article_info["importance"]).replace('-Class', '')
+        if project_type == "wp" and importance == "Unassessed":
+            importance = "Unknown"
+
+        df.at[index, 'quality'] = quality
+        df.at[index, 'importance'] = importance
+
+    # Categories and images of the changed articles are extracted again by the next stages
+    df.loc[changed, "categories"] = np.nan
+    df.loc[changed, "n_images"] = np.nan
+    df.loc[changed, "lastrevid"] = current[changed]
+
+    write_dataset(df, articles_path)
+
+    if dataset_exists(images_path):
+        df_images = read_dataset(images_path)
+        write_dataset(df_images[~df_images["article"].isin(df.loc[changed, "article"])], images_path)
+
+
+def extract_categories(project_name, project_type, wiki=None):
+    articles_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}'
+    journal_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}_categories_journal.csv'
 
     # Load list of articles
-    df = pd.read_csv(articles_path)
+    df = read_dataset(articles_path)
 
     if "categories" not in df:
         df["categories"] = np.nan
 
+    # Recover the results of an interrupted run
+    if os.path.exists(journal_path):
+        df = replay_journal(df, journal_path, ["categories", "lastrevid"])
+
     print("\nCATEGORIES EXTRACTION")
-    sect = []
     pbar = tqdm(total=len(df))
 
-    for index, row in df.iterrows():
-        if pd.isna(row["categories"]):
-            sect.append(row["article"])
+    # Articles with categories from a previous run are skipped
+    pending = df.loc[df["categories"].isna(), "article"].astype(str).tolist()
+    pbar.update(len(df) - len(pending))
 
-        if len(sect) >= 50 or index + 1 == len(df):
-            # Extract categories
-            cat_info = get_categories(sect)
-            df_sect = pd.DataFrame.from_dict(cat_info)
+    size = 50
+    pending_split = [pending[x:x + size] for x in range(0, len(pending), size)]
 
-            # Split dataframe
-            df_categories = df[["article", "categories"]]
-            df.drop('categories', axis=1, inplace=True)
+    for sect in pending_split:
+        # Extract categories
+        cat_info = get_categories(sect, wiki)
+        df_sect = pd.DataFrame(cat_info, columns=["article", "categories", "lastrevid"])
 
-            # Join old info with new info
-            df_categories = pd.concat([df_categories, df_sect]).dropna().reset_index(drop=True)
+        # Append only the new results to the journal
+        df_sect.to_csv(journal_path, mode='a', header=not os.path.exists(journal_path), index=False, encoding='utf-8-sig')
 
-            # Merge the split dataset
-            df = pd.merge(df, df_categories.drop_duplicates(keep='first'), how="left", on=['article'],
-                          validate="many_to_one")
+        pbar.update(len(sect))
 
-            # Save dataframe to csv file
-            df.to_csv(articles_path, index=False, encoding='utf-8-sig')
+    pbar.close()
 
-            # Clear selection
-            sect = []
+    # Write the articles dataset once, at the end of the stage
+    materialize_journal(project_name, project_type, "categories", ["categories", "lastrevid"])
 
-        pbar.update(1)
 
-    pbar.close()
+def replay_journal(df, journal_path, columns):
+    df_journal = pd.read_csv(journal_path).dropna(subset=[columns[0]]).drop_duplicates(subset="article", keep='first')
+    df_journal = df_journal.set_index("article")
+
+    # Fill only the missing values, previous results take precedence
+    for column in columns:
+        if column not in df:
+            df[column] = np.nan
 
+        if column in df_journal:
+            df[column] = df[column].fillna(df["article"].map(df_journal[column]))
 
-def extract_images(project_name, project_type):
+    return df
 
-    articles_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}.csv'
-    images_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}_images.csv'
+
+def materialize_journal(project_name, project_type, journal, columns):
+    articles_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}'
+    journal_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}_{journal}_journal.csv'
+
+    # Pipelined stages update the same articles dataset, one at a time
+    with materialize_lock:
+        if not os.path.exists(journal_path):
+            return
+
+        df = read_dataset(articles_path)
+        df = replay_journal(df, journal_path, columns)
+        write_dataset(df, articles_path)
+
+        # The journal is fully merged in the articles dataset
+        os.remove(journal_path)
+
+
+def extract_images(project_name, project_type, workers=1, processes=1, discovery="wikitext", on_images=None, wiki=None):
+
+    articles_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}'
+    images_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}_images'
+    journal_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}_n_images_journal.csv'
+
+    images_columns = ['article', 'title', 'url', 'page url', 'thumbnail url', 'file_type', 'width', 'height', "resolution"]
 
     # Load list of pages
-    df = pd.read_csv(articles_path)
+    df = read_dataset(articles_path)
     if "n_images" not in df:
         df["n_images"] = np.nan
 
-    # Create, if not existing, and load images dataset
-    if not os.path.exists(images_path):
-        df_images = pd.DataFrame(columns=['article', 'title', 'url', 'page url', 'thumbnail url', 'file_type', 'width', 'height', "resolution"])
-        df_images.to_csv(images_path, index=False, encoding='utf-8-sig')
+    # Recover the results of an interrupted run
+    if os.path.exists(journal_path):
+        df = replay_journal(df, journal_path, ["n_images"])
+
+    # Create, if not existing, the images dataset
+    if not dataset_exists(images_path):
+        write_dataset(pd.DataFrame(columns=images_columns), images_path)
     else:
-        df_images = pd.read_csv(images_path)
+        # Drop the images appended for articles whose extraction was interrupted
+        df_images = read_dataset(images_path)
+        completed = df_images["article"].isin(df.loc[df["n_images"].notna(), "article"])
+        if not completed.all():
+            write_dataset(df_images[completed], images_path)
+        del df_images
 
     print("\nIMAGES EXTRACTION")
     pbar = tqdm(total=len(df))
 
-    for index, row in df.iterrows():
-        if pd.isna(row["n_images"]):
-            images = get_images(row["article"])
+    # Articles already processed in a previous run are skipped
+    pending = df.index[df["n_images"].isna()].tolist()
+    pbar.update(len(df) - len(pending))
 
-            n_images = len(images)
-            df.at[index, 'n_images'] = n_images
+    # Fetch images concurrently, one chunk at a time, so that a checkpoint is saved after every chunk
+    size = 100
+    pending_split = [pending[x:x + size] for x in range(0, len(pending), size)]
 
-            temp_images = pd.DataFrame({
-                "article": row["article"],
-                "title": images
-            })
+    # With many pages queued, the wikitext parsing can be moved to a pool of processes
+    parse_in_processes = discovery == "wikitext" and processes > 1 and len(pending) > size
 
-            df_images = pd.concat([df_images, temp_images]).reset_index(drop=True)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor, \
+            (ProcessPoolExecutor(max_workers=processes) if parse_in_processes else nullcontext()) as parser:
+        for chunk in pending_split:
+            # Results are consumed in article order to keep the same output of the serial extraction
+            if discovery == "api":
+                # Images listed by the API (prop=images), 50 articles per request
+                articles = df.loc[chunk, "article"].astype(str).tolist()
+                articles_split = [articles[x:x + 50] for x in range(0, len(articles), 50)]
 
-            if index % 100 == 0:
-                df.to_csv(articles_path, index=False, encoding='utf-8-sig')
-                df_images.to_csv(images_path, index=False, encoding='utf-8-sig')
+                articles_images = {}
+                for split_images in executor.map(partial(get_pages_images, wiki=wiki), articles_split):
+                    articles_images.update(split_images)
 
-        pbar.update(1)
+                chunk_images = [articles_images.get(article, []) for article in articles]
+            elif parse_in_processes:
+                chunk_wikitext = executor.map(partial(get_wikitext, wiki=wiki), df.loc[chunk, "article"].tolist())
+                chunk_images = parser.map(partial(parse_images, prefixes=file_prefixes(wiki)), chunk_wikitext, chunksize=10)
+            else:
+                chunk_images = executor.map(partial(get_images, wiki=wiki), df.loc[chunk, "article"].tolist())
+
+            images_rows = []
+            n_images_rows = []
+
+            for index, images in zip(chunk, chunk_images):
+                article = df.at[index, "article"]
+
+                images_rows += [(article, title) for title in images]
+                n_images_rows.append((article, len(images)))
+
+                pbar.update(1)
+
+            # Images are appended before the journal, so the journal only lists articles with saved images
+            df_chunk = pd.DataFrame(images_rows, columns=["article", "title"]).reindex(columns=images_columns)
+            append_dataset(df_chunk, images_path)
+
+            df_chunk = pd.DataFrame(n_images_rows, columns=["article", "n_images"])
+            df_chunk.to_csv(journal_path, mode='a', header=not os.path.exists(journal_path), index=False, encoding='utf-8-sig')
+
+            # Pass the saved images to the next stage, when pipelined
+            if on_images is not None:
+                on_images([title for article, title in images_rows])
 
-    df.to_csv(articles_path, index=False, encoding='utf-8-sig')
-    df_images.to_csv(images_path, index=False, encoding='utf-8-sig')
     pbar.close()
 
+    # Write the articles dataset once, at the end of the stage
+    materialize_journal(project_name, project_type, "n_images", ["n_images"])
+
+
+def extract_images_data(project_name, project_type, ttl=None, wiki=None):
+    images_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}_images'
+    df_images = read_dataset(images_path)
 
-def extract_images_data(project_name, project_type):
-    images_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}_images.csv'
-    df_images = pd.read_csv(images_path)
+    info_columns = ["url", "page url", "thumbnail url", "file_type", "width", "height", "resolution"]
 
     print("\nIMAGES' DATA EXTRACTION")
-    sect = []
-    pbar = tqdm(total=len(df_images))
 
-    for index, row in df_images.iterrows():
-        if pd.isna(row["url"]):
-            sect.append(row["title"])
+    # Every distinct file is resolved only once, even if it appears in many articles
+    missing = df_images.loc[df_images["url"].isna(), "title"].dropna().astype(str).unique().tolist()
 
-        if len(sect) >= 50 or index + 1 == len(df_images):
-            # Extract images info
-            images_info = get_image_info(sect)
-            df_sect = pd.DataFrame.from_dict(images_info)
+    # Files already resolved by previous runs, of any project, are loaded from the cache
+    images_info = get_cached_image_info(missing, ttl, wiki)
+    sect_list = [title for title in missing if title not in images_info]
 
-            # Split images dataframe
-            df_images_data = df_images[["title", "url", "page url", "thumbnail url", "file_type", "width", "height", "resolution"]]
-            df_images = df_images[["article", "title"]]
+    pbar = tqdm(total=len(missing))
+    pbar.update(len(missing) - len(sect_list))
 
-            # Join old images info with new images info
-            df_images_data = pd.concat([df_images_data, df_sect]).dropna().reset_index(drop=True)
+    # Batches of 50 files of the same host
+    size = 50
+    sect_split = []
+    for host, host_list in split_by_host(sect_list, wiki).items():
+        sect_split += [(host, host_list[x:x + size]) for x in range(0, len(host_list), size)]
 
-            # Merge the split dataset
-            df_images = pd.merge(df_images, df_images_data.drop_duplicates(subset="title", keep='first'), how="left", on=['title'],
-                                 validate="many_to_one")
+    for host, sect in sect_split:
+        # Extract images info and store it in the cache, which also works as checkpoint
+        sect_info = get_image_info(sect, host)
+        save_image_info(sect_info)
 
-            # Save dataframe to csv file
-            df_images.to_csv(images_path, index=False, encoding='utf-8-sig')
+        images_info.update({info["title"]: info for info in sect_info})
 
-            # Clear selection
-            sect = []
+        pbar.update(len(sect))
 
-        pbar.update(1)
+    pbar.close()
+
+    # Fill the missing images info
+    df_info = pd.DataFrame(list(images_info.values()), columns=["title"] + info_columns).drop_duplicates(subset="title").set_index("title")
+    missing_rows = df_images["url"].isna()
+
+    df_images[info_columns] = df_images[info_columns].astype(object)
+    for column in info_columns:
+        df_images.loc[missing_rows, column] = df_images.loc[missing_rows, "title"].astype(str).map(df_info[column])
 
     # Remove errors and save dataframe to csv file
     df_images.drop(df_images.loc[df_images['url'] == ""].index, inplace=True)
-    df_images.to_csv(images_path, index=False, encoding='utf-8-sig')
+    write_dataset(df_images, images_path)
 
-    pbar.close()
 
+def split_by_host(titles, wiki=None):
+    # New files are requested to the wiki, which also resolves the Commons files and records their host.
+    # Expired files known to be on Commons are requested to Commons, with its own connections and rate limit
+    wiki = wiki or DEFAULT_WIKI
+    hosts = get_image_hosts(titles, wiki)
 
-def extract_wikiprojects_list():
-    url = "https://api.wp1.openzim.org/v1/projects/"
+    split = {}
+    for title in titles:
+        split.setdefault(COMMONS_WIKI if hosts.get(title) == COMMONS_WIKI else wiki, []).append(title)
 
-    session = requests.Session()
+    return split
 
-    r = session.get(url=url)
-    data = r.json()
 
-    projects = []
+def export_project_csv(project_name, project_type):
+    # CSV copies of the working datasets, whatever the storage format
+    export_csv(f'output/{project_type}_{project_name}/{project_type}_{project_name}')
+    export_csv(f'output/{project_type}_{project_name}/{project_type}_{project_name}_images')
 
-    for wp in data:
-        projects.append(wp["name"])
 
-    return projects
+def image_filename(title, url):
+    # Name of the local copy of a file, from its title and the extension of the thumbnail
+    filename = re.sub(r'[?"><:/*|\\]', '', str(title).replace("File:", "", 1))
 
+    extension = os.path.splitext(urlparse(url).path)[1]
+    if extension and not filename.lower().endswith(extension.lower()):
+        filename += extension
 
-def download_images():
-    print("\nImage download started...\n")
-    headers = {'User-Agent': 'Mozilla/5.0 (iPad; CPU OS 12_2 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148'}
-    df_images = pd.read_csv(f'output/test/Wikiproject_Chemistry_images.csv')
+    return filename
 
-    pbar = tqdm(total=df_images.shape[0])
 
-    for index, row in df_images.iterrows():
-        try:
-            filename = re.sub(r'[?"><:/*|]', '', row['filename'])
-            if isinstance(row['thumbnail url'], str) and not os.path.exists(f"output/test/images/{filename}"):
-                url = row['thumbnail url']
-                r = requests.get(url, allow_redirects=True, headers=headers)
-                if not r.ok:
-                    print(index, row["thumbnail url"], r.status_code, r.ok)
+def download_file(url, path):
+    # Stream the file to a temporary path, renamed only when complete
+    part_path = f"{path}.part"
+    size = 0
 
-                else:
-                    file = open(f'output/test/images/{filename}', 'wb')
-                    file.write(r.content)
-                    file.close()
+    try:
+        r = client.get(url, stream=True)
+        with r:
+            if not r.ok:
+                print(url, r.status_code, r.ok)
+                return 0
 
-        except Exception as e:
-            print(e)
+            with open(part_path, 'wb') as file:
+                for chunk in r.iter_content(chunk_size=64 * 1024):
+                    file.write(chunk)
+                    size += len(chunk)
 
-        pbar.update(1)
+        os.replace(part_path, path)
 
+    except Exception as e:
+        print(url, e)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return 0
 
-def check_connection():
-    try:
-        res = requests.get('https://www.google.it/')
-        if res.status_code:
-            return True
-        else:
-            return False
+    return size
+
+
+def download_images(project_name, project_type, workers=4, images_dir="output/images"):
+    images_path = f'output/{project_type}_{project_name}/{project_type}_{project_name}_images'
+    df_images = read_dataset(images_path)
+
+    print("\nIMAGES DOWNLOAD")
+
+    # Thumbnails are shared by every project, each file is downloaded once
+    os.makedirs(images_dir, exist_ok=True)
+
+    df_files = df_images[["title", "thumbnail url"]].dropna()
+    df_files = df_files[df_files["thumbnail url"].astype(str).str.startswith("http")]
+    df_files["filename"] = [image_filename(title, url) for title, url in zip(df_files["title"], df_files["thumbnail url"])]
+    df_files = df_files.drop_duplicates(subset="filename")
+
+    # Files downloaded by previous runs, of any project, are skipped
+    files = [(url, os.path.join(images_dir, filename)) for url, filename in zip(df_files["thumbnail url"], df_files["filename"])]
+    files = [(url, path) for url, path in files if not os.path.exists(path)]
+
+    pbar = tqdm(total=len(df_files), unit="file")
+    pbar.update(len(df_files) - len(files))
+
+    start = time.time()
+    downloaded_bytes = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for size in executor.map(lambda file: download_file(*file), files):
+            downloaded_bytes += size
+
+            pbar.update(1)
+            pbar.set_postfix_str(f"{downloaded_bytes / max(time.time() - start, 1e-6) / 1024:.0f} KiB/s")
+
+    pbar.close()
+
+    elapsed = time.time() - start
+    print(f"\n{downloaded_bytes} bytes downloaded in {elapsed:.1f}s ({downloaded_bytes / max(elapsed, 1e-6):.0f} bytes/sec)")
 
-    except:
-        return False
+    return {"files": len(files), "bytes": downloaded_bytes, "time": elapsed}
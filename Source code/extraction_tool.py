@@ -1,6 +1,6 @@
 print("\nInitializing the tool. Please wait...")
 
-from extraction import extract_wikiprojects_list, full_extraction, check_connection
+from wikiprojects import extract_wikiprojects_list, check_connection
 import shutil
 import os
 import pathlib
@@ -38,7 +38,8 @@ wp_menu = {
 extract_data_menu = {
     1: "Keep existing files and fill missing data",
     2: "Delete existing files and  extract data",
-    3: "Back"
+    3: "Refresh articles changed since the last extraction",
+    4: "Back"
 }
 
 list_menu = {}
@@ -94,10 +95,11 @@ def select_wp():
             clear()
             wikiproject_id = wikiproject_id.replace(" ", "_")
             extract_data(project_name=wikiproject_id, project_type="wp")
+            return
 
         else:
             if wikiproject_id.lower() in ["2", "back"]:
-                main()
+                return
             else:
                 print(f'{Colors.WARNING}"{wikiproject_id}" is not a valid Wikiproject.{Colors.ENDC}')
 
@@ -119,15 +121,18 @@ def select_list():
         if isinstance(option, int) and option < len(list_menu):
             list_name = list_menu[option][:-4]
             extract_data(project_name=list_name, project_type="list")
+            return
 
         elif isinstance(option, int) and option == len(list_menu):
-            main()
+            return
 
         else:
             print(f'{Colors.WARNING}Invalid option. Please enter a number between 1 and {len(list_menu)}.{Colors.ENDC}')
 
 
 def extract_data(project_name, project_type):
+    refresh = False
+
     while True:
         # Create project output folder
         if os.path.exists(f"output/{project_type}_{project_name}"):
@@ -152,7 +157,11 @@ def extract_data(project_name, project_type):
                 break
 
             elif option == 3:
-                main()
+                refresh = True
+                break
+
+            elif option == 4:
+                return
 
             else:
                 print(f'{Colors.WARNING}Invalid option. Please enter a number between 1 and {len(extract_data_menu)}.{Colors.ENDC}')
@@ -162,13 +171,16 @@ def extract_data(project_name, project_type):
 
     clear()
     print(f'\nExtraction of "{project_name}" started')
-    full_extraction(project_name=project_name, project_type=project_type)
+
+    # Loaded only when needed, to keep the startup fast
+    from extraction import full_extraction
+
+    full_extraction(project_name=project_name, project_type=project_type, refresh=refresh)
     print(f"\n{Colors.OKGREEN}Done!{Colors.ENDC}\n")
     input("\nPress Enter to continue...")
     clear()
     print(f'\nYou can find the output at "output/{project_type}_{project_name}/"')
     input("\nPress Enter to continue...")
-    main()
 
 
 if __name__ == "__main__":
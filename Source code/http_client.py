@@ -0,0 +1,222 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from instrumentation import record_request
+import threading
+import random
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+USER_AGENT = "VCAT-data-extractor/1.0 (https://github.com/Aquets/VCAT-data-extractor)"
+
+# Every host (wikis, Commons, wp1) has its own pool of connections kept alive, and its own rate limiter.
+# Pools of up to POOL_CONNECTIONS hosts are kept, each sized for the concurrent extraction stages
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 32
+
+# Seconds to wait for the connection and for the response
+TIMEOUT = (10, 60)
+
+# Requests per second allowed for each host, and size of the burst
+RATE = 20
+BURST = 20
+
+# Concurrent requests allowed for each host, adapted to the observed errors
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 16
+
+# Retries of throttled or failed requests, with exponential backoff (seconds)
+MAX_RETRIES = 6
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+
+# Status codes of throttled or temporarily unavailable servers
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+
+class RateLimiter:
+    def __init__(self, rate=RATE, burst=BURST, min_concurrency=MIN_CONCURRENCY, max_concurrency=MAX_CONCURRENCY):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(max_concurrency)
+        self.active = 0
+
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        # Returns the seconds spent waiting for a free slot and a token
+        start = time.monotonic()
+
+        with self.condition:
+            while self.active >= int(self.concurrency):
+                self.condition.wait()
+            self.active += 1
+
+        # Token bucket: refill at the allowed rate, wait when it is empty
+        while True:
+            with self.condition:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+        return time.monotonic() - start
+
+    def release(self, throttled=False):
+        with self.condition:
+            self.active -= 1
+
+            # Additive increase on success, multiplicative decrease on throttling
+            if throttled:
+                self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+            else:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+            self.condition.notify_all()
+
+
+class Client:
+    def __init__(self, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, timeout=TIMEOUT, max_retries=MAX_RETRIES):
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "User-Agent": USER_AGENT,
+            "Accept-Encoding": "gzip, deflate",
+        })
+
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+        # Seconds spent waiting for the rate limiters and for the backoff, and number of retries
+        self.throttled_time = 0
+        self.retries = 0
+
+    def get_limiter(self, host):
+        with self.lock:
+            if host not in self.limiters:
+                self.limiters[host] = RateLimiter(rate=RATE, burst=BURST, min_concurrency=MIN_CONCURRENCY, max_concurrency=MAX_CONCURRENCY)
+            return self.limiters[host]
+
+    def add_throttled_time(self, seconds, retry=False):
+        with self.lock:
+            self.throttled_time += seconds
+            if retry:
+                self.retries += 1
+
+    def get(self, url, params=None, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlparse(url).netloc
+        limiter = self.get_limiter(host)
+
+        for attempt in range(self.max_retries + 1):
+            self.add_throttled_time(limiter.acquire())
+            start = time.perf_counter()
+
+            response = None
+
+            # The slot is released exactly once, whatever the outcome of the request
+            throttled = True
+            try:
+                response = self.session.get(url=url, params=params, **kwargs)
+                delay = retry_delay(response, attempt)
+                throttled = delay is not None
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                delay = backoff(attempt)
+            finally:
+                limiter.release(throttled=throttled)
+
+            if response is not None:
+                if delay is None:
+                    record_request(host, time.perf_counter() - start, response_size(response, kwargs.get("stream")), attempt)
+                    return response
+
+                if attempt == self.max_retries:
+                    raise requests.HTTPError(f"Request throttled {attempt + 1} times: {response.url}", response=response)
+
+                # Return the connection of the discarded response to the pool, also when streamed
+                response.close()
+
+            self.add_throttled_time(delay, retry=True)
+            time.sleep(delay)
+
+    def reset_report(self):
+        with self.lock:
+            self.throttled_time = 0
+            self.retries = 0
+
+    def report(self):
+        return {
+            "throttled_time": round(self.throttled_time, 3),
+            "retries": self.retries,
+        }
+
+
+def backoff(attempt):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def response_size(response, stream=False):
+    # Bytes received on the wire, before the gzip decoding of the body.
+    # Streamed bodies are not read here, their size comes from the headers
+    if stream:
+        return int(response.headers.get("Content-Length", 0))
+
+    # The raw stream counts the bytes read from the connection, once the content has been read
+    content = response.content
+    tell = getattr(response.raw, "tell", None)
+    if tell is not None:
+        return tell()
+
+    return len(content)
+
+
+def decode_json(response):
+    # orjson parses the large API responses several times faster than the standard library
+    if orjson is not None:
+        return orjson.loads(response.content)
+
+    return response.json()
+
+
+def retry_delay(response, attempt):
+    # Returns None when the response can be used, or the seconds to wait before retrying
+    lagged = response.headers.get("MediaWiki-API-Error") == "maxlag"
+
+    if response.status_code not in RETRY_STATUS and not lagged:
+        return None
+
+    retry_after = response.headers.get("Retry-After")
+    if retry_after is not None and retry_after.isdigit():
+        return min(BACKOFF_MAX, int(retry_after)) + random.uniform(0, 1)
+
+    return backoff(attempt)
+
+
+# Shared by every thread of the process, the pooled connections are reused across requests
+client = Client()
@@ -0,0 +1,108 @@
+from instrumentation import record_cache
+from mediawiki_action_api import DEFAULT_WIKI, COMMONS_WIKI
+import sqlite3
+import time
+import os
+
+
+CACHE_PATH = "output/image_info_cache.sqlite"
+
+# Seconds before files not found (url "") are requested again, they can be uploaded later
+MISSING_TTL = 24 * 60 * 60
+
+
+def connect(cache_path=CACHE_PATH):
+    if os.path.dirname(cache_path):
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+    # Wait for the lock when several processes write to the cache
+    connection = sqlite3.connect(cache_path, timeout=60)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS image_info (
+            host TEXT,
+            title TEXT,
+            url TEXT,
+            page_url TEXT,
+            thumbnail_url TEXT,
+            file_type TEXT,
+            width INTEGER,
+            height INTEGER,
+            resolution TEXT,
+            updated REAL,
+            PRIMARY KEY (host, title)
+        )
+    """)
+
+    return connection
+
+
+def lookup_image_info(_images, min_updated, min_missing_updated, wiki=None, cache_path=CACHE_PATH):
+    files = {}
+
+    # Local files of the wiki take precedence over the Commons ones with the same title
+    hosts = [COMMONS_WIKI, wiki or DEFAULT_WIKI]
+
+    connection = connect(cache_path)
+
+    # Split filenames in group of 500 to stay below the SQLite variables limit
+    size = 500
+    images_split = [_images[x:x + size] for x in range(0, len(_images), size)]
+
+    for img in images_split:
+        placeholders = ",".join("?" * len(img))
+        rows = connection.execute(
+            f"SELECT title, url, page_url, thumbnail_url, file_type, width, height, resolution, host "
+            f"FROM image_info WHERE updated >= (CASE WHEN url = '' THEN ? ELSE ? END) "
+            f"AND host IN (?, ?) AND title IN ({placeholders}) "
+            f"ORDER BY host = ?",
+            [min_missing_updated, min_updated] + hosts + img + [hosts[1]]
+        )
+
+        for row in rows:
+            files[row[0]] = {
+                "title": row[0],
+                "url": row[1],
+                "page url": row[2],
+                "thumbnail url": row[3],
+                "file_type": row[4],
+                "width": row[5],
+                "height": row[6],
+                "resolution": row[7],
+                "host": row[8]
+            }
+
+    connection.close()
+
+    return files
+
+
+def get_cached_image_info(_images, ttl=None, wiki=None, cache_path=CACHE_PATH):
+    # Entries older than ttl (in seconds) are considered expired
+    min_updated = time.time() - ttl if ttl is not None else 0
+    min_missing_updated = max(min_updated, time.time() - MISSING_TTL)
+
+    files = lookup_image_info(_images, min_updated, min_missing_updated, wiki, cache_path)
+
+    record_cache("image_info", len(files), len(_images) - len(files))
+
+    return files
+
+
+def get_image_hosts(_images, wiki=None, cache_path=CACHE_PATH):
+    # Host owning each file in previous runs, expired entries included
+    files = lookup_image_info(_images, 0, 0, wiki, cache_path)
+    return {title: info["host"] for title, info in files.items()}
+
+
+def save_image_info(_files, cache_path=CACHE_PATH):
+    updated = time.time()
+
+    connection = connect(cache_path)
+
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO image_info VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(f.get("host") or DEFAULT_WIKI, f["title"], f["url"], f["page url"], f["thumbnail url"], f["file_type"], f["width"], f["height"], f["resolution"], updated) for f in _files]
+        )
+
+    connection.close()
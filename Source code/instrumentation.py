@@ -0,0 +1,171 @@
+from contextlib import contextmanager
+from functools import wraps
+from datetime import datetime
+import tracemalloc
+import threading
+import cProfile
+import time
+import json
+
+
+lock = threading.Lock()
+local = threading.local()
+
+# Metrics of the current run
+api_metrics = {}
+cache_metrics = {}
+stage_metrics = {}
+totals = {"requests": 0, "bytes": 0, "retries": 0}
+started = None
+
+
+def reset():
+    global started
+
+    with lock:
+        api_metrics.clear()
+        cache_metrics.clear()
+        stage_metrics.clear()
+        totals.update({"requests": 0, "bytes": 0, "retries": 0})
+        started = datetime.now().isoformat(timespec="seconds")
+
+
+def get_api_metrics(name):
+    # Called with the lock held
+    if name not in api_metrics:
+        api_metrics[name] = {"calls": 0, "requests": 0, "bytes": 0, "retries": 0, "wall_time": 0, "batch_sizes": [], "latencies": []}
+    return api_metrics[name]
+
+
+def instrumented(function):
+    # Requests are counted for the outermost instrumented function of the thread
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        batch_size = len(args[0]) if args and isinstance(args[0], (list, tuple)) else 1
+
+        outer = getattr(local, "function", None)
+        if outer is None:
+            local.function = function.__name__
+
+        start = time.perf_counter()
+
+        try:
+            return function(*args, **kwargs)
+
+        finally:
+            with lock:
+                metrics = get_api_metrics(function.__name__)
+                metrics["calls"] += 1
+                metrics["wall_time"] += time.perf_counter() - start
+                metrics["batch_sizes"].append(batch_size)
+
+            local.function = outer
+
+    return wrapper
+
+
+def record_request(host, latency, size, retries):
+    name = getattr(local, "function", None) or f"other ({host})"
+
+    with lock:
+        metrics = get_api_metrics(name)
+        metrics["requests"] += 1
+        metrics["bytes"] += size
+        metrics["retries"] += retries
+        metrics["latencies"].append(latency)
+
+        totals["requests"] += 1
+        totals["bytes"] += size
+        totals["retries"] += retries
+
+
+def record_cache(name, hits, misses):
+    with lock:
+        metrics = cache_metrics.setdefault(name, {"hits": 0, "misses": 0})
+        metrics["hits"] += hits
+        metrics["misses"] += misses
+
+
+@contextmanager
+def stage(name, profile_path=None):
+    with lock:
+        before = dict(totals)
+
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+    # cProfile only follows the thread running the stage
+    profiler = cProfile.Profile() if profile_path else None
+    if profiler is not None:
+        profiler.enable()
+
+    start = time.perf_counter()
+
+    try:
+        yield
+
+    finally:
+        wall_time = time.perf_counter() - start
+
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+
+        with lock:
+            stage_metrics[name] = {
+                "wall_time": round(wall_time, 3),
+                "requests": totals["requests"] - before["requests"],
+                "bytes": totals["bytes"] - before["bytes"],
+                "retries": totals["retries"] - before["retries"],
+                "peak_memory": tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None,
+                "profile": profile_path,
+            }
+
+
+def percentile(values, q):
+    if not values:
+        return None
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def build_report(info=None):
+    with lock:
+        api = {}
+        for name, metrics in api_metrics.items():
+            batch_sizes = metrics["batch_sizes"]
+            latencies = metrics["latencies"]
+
+            api[name] = {
+                "calls": metrics["calls"],
+                "requests": metrics["requests"],
+                "bytes": metrics["bytes"],
+                "retries": metrics["retries"],
+                "wall_time": round(metrics["wall_time"], 3),
+                "batch_size": {
+                    "min": min(batch_sizes) if batch_sizes else None,
+                    "mean": round(sum(batch_sizes) / len(batch_sizes), 2) if batch_sizes else None,
+                    "max": max(batch_sizes) if batch_sizes else None,
+                },
+                "latency": {f"p{q}": round(percentile(latencies, q), 4) if latencies else None for q in [50, 90, 99]},
+            }
+
+        cache = {}
+        for name, metrics in cache_metrics.items():
+            lookups = metrics["hits"] + metrics["misses"]
+            cache[name] = {**metrics, "hit_rate": round(metrics["hits"] / lookups, 4) if lookups else None}
+
+        return {
+            **(info or {}),
+            "started": started,
+            "stages": dict(stage_metrics),
+            "api": api,
+            "cache": cache,
+            "totals": dict(totals),
+        }
+
+
+def write_report(path, info=None):
+    with open(path, "w") as outfile:
+        json.dump(build_report(info), outfile, indent=2)
@@ -1,9 +1,100 @@
-import requests
 import re
 from urllib.parse import unquote
+from functools import lru_cache
+from http_client import client, decode_json
+import numpy as np
+from instrumentation import instrumented
 
 
-def get_featured_image(_pages):
+# Wiki of the projects, when not specified
+DEFAULT_WIKI = "en.wikipedia.org"
+
+# Shared repository of the files not uploaded to the wikis
+COMMONS_WIKI = "commons.wikimedia.org"
+
+API_URL = "https://{wiki}/w/api.php"
+INDEX_URL = "https://{wiki}/w/index.php"
+
+# Requests are refused, and retried by the client, when the database replication lag exceeds these seconds
+MAXLAG = 5
+
+
+def api_url(wiki=None):
+    return API_URL.format(wiki=wiki or DEFAULT_WIKI)
+
+
+def index_url(wiki=None):
+    return INDEX_URL.format(wiki=wiki or DEFAULT_WIKI)
+
+
+def merge_page(page, partial_page):
+    for key, value in partial_page.items():
+        if isinstance(value, list):
+            page.setdefault(key, []).extend(value)
+        elif isinstance(value, dict):
+            page.setdefault(key, {}).update(value)
+        else:
+            page[key] = value
+
+
+def query_pages(_params, wiki=None, ignore_continue=()):
+    PARAMS = {
+        "action": "query",
+        "format": "json",
+        "maxlag": MAXLAG,
+        **_params,
+    }
+
+    requested = _params["titles"].split("|") if "titles" in _params else []
+    normalized = {}
+    redirects = {}
+    pages = {}
+
+    while True:
+        R = client.get(url=api_url(wiki), params=PARAMS)
+        data = decode_json(R)
+        if "query" not in data:
+            break
+
+        normalized.update({n["from"]: n["to"] for n in data["query"].get("normalized", [])})
+        redirects.update({r["from"]: r["to"] for r in data["query"].get("redirects", [])})
+
+        # Props of a page can be split across continuation chunks
+        for page_id, partial_page in data["query"].get("pages", {}).items():
+            merge_page(pages.setdefault(page_id, {}), partial_page)
+
+        # Continuations of the ignored keys alone (e.g. older revisions of the files) are not followed
+        pending = [key for key in data.get("continue", {}) if key != "continue"]
+        done = "continue" not in data or (pending and all(key in ignore_continue for key in pending))
+
+        # Pages are complete once the batch is complete
+        if "batchcomplete" in data or done:
+            yield from resolve_pages(pages, requested, normalized, redirects)
+            pages = {}
+
+        if done:
+            break
+
+        PARAMS = {**PARAMS, **data["continue"]}
+
+    yield from resolve_pages(pages, requested, normalized, redirects)
+
+
+def resolve_pages(pages, requested, normalized, redirects):
+    # Map every page back to the requested titles that point to it
+    requested_titles = {}
+    for title in requested:
+        resolved = normalized.get(title, title)
+        resolved = redirects.get(resolved, resolved)
+        requested_titles.setdefault(resolved, []).append(title)
+
+    for page in pages.values():
+        page["requested"] = requested_titles.get(page.get("title"), [])
+        yield page
+
+
+@instrumented
+def get_featured_image(_pages, wiki=None):
 
     files = {}
 
@@ -12,28 +103,17 @@ def get_featured_image(_pages):
 
     for pg in pages_split:
 
-        pages = "|".join(pg)
-
-        S = requests.Session()
-
-        URL = "https://en.wikipedia.org/w/api.php"
-
         PARAMS = {
-            "action": "query",
-            "format": "json",
             "prop": "pageimages",
             "piprop": "original|name",
-            "titles": pages,
+            "titles": "|".join(pg),
         }
 
-        R = S.get(url=URL, params=PARAMS)
-        data = R.json()["query"]["pages"]
-
-        for page in data:
-            page_title = data[page]["title"]
+        for page in query_pages(PARAMS, wiki):
+            page_title = page["title"]
             try:
-                f_image_url = data[page]['original']['source']
-                f_image_title = f"File:{data[page]['pageimage']}"
+                f_image_url = page['original']['source']
+                f_image_title = f"File:{page['pageimage']}"
             except:
                 f_image_url = ""
                 f_image_title = ""
@@ -43,21 +123,89 @@ def get_featured_image(_pages):
     return files
 
 
-def get_images(_page):
+# Image extensions extracted from the wikitext
+FILE_EXTENSIONS = r"\.(?:svg|png|jpe?g|gif)"
+
+# Names of the File namespace and redirect magic words of the default wiki, other wikis have their own
+FILE_PREFIXES = ("File", "Image")
+REDIRECT_WORDS = ("#REDIRECT",)
+
+
+@lru_cache(maxsize=None)
+def images_patterns(prefixes=FILE_PREFIXES):
+    # Spaces and underscores are equivalent in the names of the namespace
+    names = "|".join(re.escape(prefix).replace(r"\ ", "[ _]") for prefix in prefixes)
+
+    # Single scan of the wikitext for <gallery> blocks, [[File:]]/[[Image:]] links and template parameters (image=...)
+    images_re = re.compile(
+        r"<gallery[^>]*>(?P<gallery>.*?)</gallery>"
+        r"|\[\[\s*(?:" + names + r")\s*:(?P<link>[^|\[\]{}\n/]+?" + FILE_EXTENSIONS + r")\s*[|\]]"
+        r"|=\s*(?:(?:" + names + r")\s*:)?(?P<param>[^|=\[\]{}<>\n/]+?" + FILE_EXTENSIONS + r")\s*(?=[|}<\n]|$)",
+        re.IGNORECASE | re.DOTALL
+    )
+
+    # One file per line inside a <gallery> block, optionally followed by a caption
+    gallery_re = re.compile(
+        r"^\s*(?:(?:" + names + r")\s*:)?(?P<entry>[^|\n/]+?" + FILE_EXTENSIONS + r")\s*(?:\||$)",
+        re.IGNORECASE | re.MULTILINE
+    )
+
+    return images_re, gallery_re
+
+
+@lru_cache(maxsize=None)
+@instrumented
+def get_site_info(wiki):
+    # Local names of the File namespace and of the redirects, e.g. "Datei" and "#WEITERLEITUNG"
+    PARAMS = {
+        "action": "query",
+        "format": "json",
+        "meta": "siteinfo",
+        "siprop": "namespaces|namespacealiases|magicwords",
+    }
+
+    R = client.get(url=api_url(wiki), params=PARAMS)
+    data = decode_json(R)["query"]
+
+    namespace = data["namespaces"]["6"]
+    prefixes = [namespace["canonical"], namespace["*"]]
+    prefixes += [alias["*"] for alias in data["namespacealiases"] if alias["id"] == 6]
+
+    redirects = [word for magic_word in data["magicwords"] if magic_word["name"] == "redirect" for word in magic_word["aliases"]]
+
+    return {
+        "file_prefixes": tuple(dict.fromkeys(FILE_PREFIXES + tuple(prefixes))),
+        "redirect_words": tuple(dict.fromkeys(REDIRECT_WORDS + tuple(redirects))),
+    }
+
+
+def file_prefixes(wiki=None):
+    if wiki is None or wiki == DEFAULT_WIKI:
+        return FILE_PREFIXES
+    return get_site_info(wiki)["file_prefixes"]
 
-    S = requests.Session()
 
-    URL = "https://en.wikipedia.org/w/index.php"
+def redirect_words(wiki=None):
+    if wiki is None or wiki == DEFAULT_WIKI:
+        return REDIRECT_WORDS
+    return get_site_info(wiki)["redirect_words"]
+
+
+@instrumented
+def get_wikitext(_page, wiki=None):
+
+    URL = index_url(wiki)
 
     PARAMS = {
         "action": "raw",
         "title": _page,
     }
 
-    R = S.get(url=URL, params=PARAMS)
+    R = client.get(url=URL, params=PARAMS)
     data = R.text
 
-    if data[:9] == "#REDIRECT":
+    # Redirect magic words are case insensitive
+    if data.lstrip()[:30].upper().startswith(tuple(word.upper() for word in redirect_words(wiki))):
         _page = data[data.find("[[")+2:data.find("]]")]
 
         PARAMS = {
@@ -65,41 +213,81 @@ def get_images(_page):
             "title": _page,
         }
 
-        R = S.get(url=URL, params=PARAMS)
+        R = client.get(url=URL, params=PARAMS)
         data = R.text
 
-    file_types = [".svg", ".png", ".jpg", ".jpeg", ".gif"]
+    return data
+
+
+def parse_images(_wikitext, prefixes=FILE_PREFIXES):
+
     files = []
 
-    for f_type in file_types:
-        re_string = "=.*?" + f_type + "|:.*?" + f_type
-        files += re.findall(re_string, data, re.IGNORECASE)
-
-    for i in range(len(files)):
-        if "File" in files[i]:
-            files[i] = files[i].split("File")[1]
-        if "[[Image" in files[i]:
-            files[i] = files[i].split("[[Image")[1]
-        if "[[file" in files[i]:
-            files[i] = files[i].split("[[file")[1]
-        if "|image" in files[i]:
-            files[i] = files[i].split("|image")[1]
-        if "|" in files[i]:
-            files[i] = files[i].split("|")[0]
-
-    files = ["File:" + f[1:].strip() for f in files]
-    files = [unquote(f) for f in files]
-
-    for f in files[:]:
-        if "/" in f:
-            files.remove(f)
-        elif not any(f_type in f.lower() for f_type in file_types):
-            files.remove(f)
+    images_re, gallery_re = images_patterns(tuple(prefixes))
+
+    for match in images_re.finditer(_wikitext):
+        if match.group("gallery") is not None:
+            names = [entry.group("entry") for entry in gallery_re.finditer(match.group("gallery"))]
+        else:
+            names = [match.group("link") or match.group("param")]
+
+        for name in names:
+            name = unquote(name.strip())
+
+            # Discard URLs and paths
+            if "/" not in name:
+                files.append("File:" + name)
 
     return files
 
 
-def get_image_info(_images):
+@instrumented
+def get_images(_page, wiki=None):
+    return parse_images(get_wikitext(_page, wiki), file_prefixes(wiki))
+
+
+@instrumented
+def get_pages_images(_pages, wiki=None):
+    output_pages = {}
+
+    # Split pages in group of 50 to send valid requests to the API
+    size = 50
+    pages_split = [_pages[x:x + size] for x in range(0, len(_pages), size)]
+
+    for pg in pages_split:
+
+        PARAMS = {
+            "prop": "images",
+            "imlimit": "max",
+            "redirects": 1,
+            "titles": "|".join(pg),
+        }
+
+        for page in query_pages(PARAMS, wiki):
+            images = [img["title"] for img in page.get("images", [])]
+            images = [img for img in images if re.search(FILE_EXTENSIONS + "$", img, re.IGNORECASE)]
+
+            # Map normalized and redirected pages back to the requested titles
+            for title in page["requested"]:
+                output_pages[title] = images
+
+    return output_pages
+
+
+def classify_resolution(width, height, file_type):
+    # Vector images and files with a side of 1920px are High-res, files with a side of 720px Mid-res.
+    # Files without size (not found) have no resolution
+    longest = np.fmax(np.asarray(width, dtype=float), np.asarray(height, dtype=float))
+
+    return np.select(
+        [np.isnan(longest), (longest >= 1920) | (np.asarray(file_type) == "svg"), longest >= 720],
+        ["", "High-res", "Mid-res"],
+        "Low-res"
+    )
+
+
+@instrumented
+def get_image_info(_images, wiki=None):
 
     files = []
 
@@ -118,83 +306,98 @@ def get_image_info(_images):
 
     for img in images_split:
 
-        images = "|".join(img)
-
-        S = requests.Session()
-
-        URL = "https://en.wikipedia.org/w/api.php"
-
         PARAMS = {
-            "action": "query",
-            "format": "json",
             "prop": "imageinfo",
             "iiprop": "url|thumbmime|size",
             "iiurlwidth": "500",
-            "titles": images,
+            "titles": "|".join(img),
         }
 
-        R = S.get(url=URL, params=PARAMS)
-        data = R.json()
-        if "query" in data:
-            if "normalized" in data["query"]:
-                normalized_list = data["query"]["normalized"]
-            else:
-                normalized_list = [{"from": "", "to": ""}]
-
-            data = data["query"]["pages"]
-
-        for d_img in data:
-            try:
-                title = data[d_img]["title"]
-                if list(filter(lambda d: d['to'] == title, normalized_list)):
-                    title = list(filter(lambda d: d['to'] == title, normalized_list))[0]["from"]
+        # Only the current revision of the files is needed, not their upload history
+        for page in query_pages(PARAMS, wiki, ignore_continue=["iistart"]):
+            # Files of the shared repository are owned by Commons, the others by the requested wiki
+            host = COMMONS_WIKI if page.get("imagerepository") == "shared" else (wiki or DEFAULT_WIKI)
 
-                info = data[d_img]["imageinfo"]
+            # Missing and invalid files have no imageinfo
+            info = page.get("imageinfo")
 
+            if info:
                 url = info[0]["url"]
                 page_url = info[0]["descriptionurl"]
-                thumbnail_url = info[0]["thumburl"]
+                thumbnail_url = info[0].get("thumburl", "")
                 width = info[0]["width"]
                 height = info[0]["height"]
-
-                file_type = title.split('.')[-1].lower()
-                if file_type == "jpeg":
-                    file_type = "jpg"
-
-                if width >= 1920 or height >= 1920 or file_type == "svg":
-                    resolution = "High-res"
-                elif width >= 720 or height >= 720:
-                    resolution = "Mid-res"
-                else:
-                    resolution = "Low-res"
-            except:
-                url = page_url = thumbnail_url = file_type = width = height = resolution = ""
-
-            file_to_add = {
-                "title": title,
-                "url": url,
-                "page url": page_url,
-                "thumbnail url": thumbnail_url,
-                "file_type": file_type,
-                "width": width,
-                "height": height,
-                "resolution": resolution
-            }
-
-            files.append(file_to_add)
+            else:
+                url = page_url = thumbnail_url = width = height = ""
+
+            # One row for every requested file name pointing to the page, before the API normalization
+            for title in page["requested"] or [page["title"]]:
+                file_type = ""
+                if info:
+                    file_type = title.split('.')[-1].lower()
+                    if file_type == "jpeg":
+                        file_type = "jpg"
+
+                file_to_add = {
+                    "title": title,
+                    "url": url,
+                    "page url": page_url,
+                    "thumbnail url": thumbnail_url,
+                    "file_type": file_type,
+                    "width": width,
+                    "height": height,
+                    "resolution": "",
+                    "host": host
+                }
+
+                files.append(file_to_add)
+
+    # Resolution of all the files at once
+    widths = [f["width"] if f["url"] else np.nan for f in files]
+    heights = [f["height"] if f["url"] else np.nan for f in files]
+    file_types = [f["file_type"] for f in files]
+
+    for file, resolution in zip(files, classify_resolution(widths, heights, file_types)):
+        file["resolution"] = str(resolution)
 
     return files
 
 
-def get_assessment(_page):
+def parse_assessment(data, project=None):
+    title = data["title"]
+    url = data.get("fullurl", "")
+    quality = importance = ""
+
+    try:
+        assessment_keys = list(data["pageassessments"].keys())
+
+        if project in assessment_keys:
+            quality = data["pageassessments"][project]["class"]
+            importance = data["pageassessments"][project]["importance"]
+        elif "Wikipedia 1.0" in assessment_keys:
+            quality = data["pageassessments"]["Wikipedia 1.0"]["class"]
+            importance = data["pageassessments"]["Wikipedia 1.0"]["importance"]
+        elif len(assessment_keys) > 0:
+            quality = data["pageassessments"][assessment_keys[0]]["class"]
+            importance = data["pageassessments"][assessment_keys[0]]["importance"]
+    except:
+        quality = importance = ""
+
+    if importance not in ["Top-Class", "High-Class", "Mid-Class", "Low-Class"]:
+        importance = "Unassessed"
+
+    return {
+        "article": title,
+        "url": url,
+        "quality": quality,
+        "importance": importance,
+    }
 
-    S = requests.Session()
 
-    URL = "https://en.wikipedia.org/w/api.php"
+@instrumented
+def get_assessment(_page, wiki=None):
 
     PARAMS = {
-        "action": "query",
-        "format": "json",
         "prop": "pageassessments|info",
         "inprop": "url",
         "titles": _page,
@@ -207,42 +410,15 @@ def get_assessment(_page):
         "importance": "",
     }
 
-    R = S.get(url=URL, params=PARAMS)
-    data = R.json()
-    if "query" in data:
-        data = data["query"]["pages"]
-        data = data[list(data.keys())[0]]
-
-        title = data["title"]
-        url = data["fullurl"]
-
-        try:
-            assessment_keys = list(data["pageassessments"].keys())
-
-            if "Wikipedia 1.0" in assessment_keys:
-                quality = data["pageassessments"]["Wikipedia 1.0"]["class"]
-                importance = data["pageassessments"]["Wikipedia 1.0"]["importance"]
-            elif len(assessment_keys) > 0:
-                quality = data["pageassessments"][assessment_keys[0]]["class"]
-                importance = data["pageassessments"][assessment_keys[0]]["importance"]
-        except:
-            quality = importance = ""
-
-        if importance not in ["Top-Class", "High-Class", "Mid-Class", "Low-Class"]:
-            importance = "Unassessed"
-
-        output_page = {
-            "article": title,
-            "url": url,
-            "quality": quality,
-            "importance": importance,
-        }
+    for page in query_pages(PARAMS, wiki):
+        output_page = parse_assessment(page)
 
     return output_page
 
 
-def get_categories(_pages):
-    output_pages = []
+@instrumented
+def get_assessments(_pages, project=None, wiki=None):
+    output_pages = {}
 
     # Split pages in group of 50 to send valid requests to the API
     size = 50
@@ -250,41 +426,77 @@ def get_categories(_pages):
 
     for pg in pages_split:
 
-        pages = "|".join(pg)
+        PARAMS = {
+            "prop": "pageassessments|info",
+            "inprop": "url",
+            "redirects": 1,
+            "titles": "|".join(pg),
+        }
+
+        for page in query_pages(PARAMS, wiki):
+            # Follow normalization and redirects from the requested title to the returned page
+            for title in page["requested"]:
+                output_pages[title] = parse_assessment(page, project)
+
+    return output_pages
+
+
+@instrumented
+def get_categories(_pages, wiki=None):
+    output_pages = []
 
-        S = requests.Session()
+    # Split pages in group of 50 to send valid requests to the API
+    size = 50
+    pages_split = [_pages[x:x + size] for x in range(0, len(_pages), size)]
 
-        URL = "https://en.wikipedia.org/w/api.php"
+    for pg in pages_split:
 
         PARAMS = {
-            "action": "query",
-            "format": "json",
-            "prop": "categories",
+            "prop": "categories|info",
             "clshow": "!hidden",
-            "cllimit": "500",
-            "titles": pages,
+            "cllimit": "max",
+            "redirects": 1,
+            "titles": "|".join(pg),
         }
 
-        R = S.get(url=URL, params=PARAMS)
-        data = R.json()
-        if "query" in data:
-            data = data["query"]["pages"]
+        # Categories of every page, following the continuation
+        for page in query_pages(PARAMS, wiki):
+            categories = [cat["title"].replace("Category:", "") for cat in page.get("categories", [])]
+            if not categories:
+                categories = ["no category"]
 
-        for d_pg in data:
-            try:
-                title = data[d_pg]["title"]
-                categories = []
-                for cat in data[d_pg]["categories"]:
-                    categories.append(cat["title"].replace("Category:", ""))
+            # One row for every requested title pointing to the page
+            for title in page["requested"] or [page["title"]]:
+                page_to_add = {
+                    "article": title,
+                    "categories": ",".join(categories),
+                    "lastrevid": page.get("lastrevid")
+                }
 
-            except:
-                categories = ["no category"]
+                output_pages.append(page_to_add)
+
+    return output_pages
+
+
+@instrumented
+def get_revisions(_pages, wiki=None):
+    output_pages = {}
 
-            page_to_add = {
-                "article": title,
-                "categories": ",".join(categories)
-            }
+    # Split pages in group of 50 to send valid requests to the API
+    size = 50
+    pages_split = [_pages[x:x + size] for x in range(0, len(_pages), size)]
+
+    for pg in pages_split:
+
+        PARAMS = {
+            "prop": "info",
+            "redirects": 1,
+            "titles": "|".join(pg),
+        }
 
-            output_pages.append(page_to_add)
+        # Latest revision of every page, of the target for redirects, missing pages have none
+        for page in query_pages(PARAMS, wiki):
+            for title in page["requested"]:
+                output_pages[title] = page.get("lastrevid")
 
     return output_pages
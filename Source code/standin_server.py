@@ -0,0 +1,265 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import threading
+import random
+import zlib
+import math
+import json
+import time
+import re
+
+
+FILE_TYPES = ["jpg", "png", "svg", "gif"]
+QUALITY_GRADES = ["FA", "GA", "B", "C", "Start", "Stub"]
+IMPORTANCE_GRADES = ["Top", "High", "Mid", "Low"]
+
+
+# Local stand-in for the MediaWiki Action API, index.php and the wp1 API.
+# Pages are synthetic and deterministic: "Article {n}" uses images_per_article files drawn from a
+# pool of image_pool files shared by all the articles, and one article every redirect_every is a redirect.
+# Every request waits latency seconds and fails with probability error_rate (503, 429 or maxlag).
+class StandInServer:
+    def __init__(self, articles=1000, images_per_article=5, image_pool=None, redirect_every=50,
+                 latency=0.0, error_rate=0.0, seed=0):
+        self.articles = articles
+        self.images_per_article = images_per_article
+        self.image_pool = image_pool or max(1, articles)
+        self.redirect_every = redirect_every
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive connections, like the real servers
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                standin.handle(self)
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.request_queue_size = 256
+        self.server.daemon_threads = True
+
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # Requests
+
+    def handle(self, request):
+        url = urlparse(request.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        with self.lock:
+            self.requests += 1
+            failure = self.random.random() < self.error_rate
+            if failure:
+                self.errors += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if failure:
+            return self.send_error(request, url.path)
+
+        if url.path.endswith("/api.php"):
+            return send(request, 200, json.dumps(self.query(params)), "application/json")
+
+        if url.path.endswith("/index.php"):
+            return send(request, 200, self.wikitext(params.get("title", "")), "text/x-wiki")
+
+        match = re.match(r"^/v1/projects/(?P<project>[^/]+)/articles$", url.path)
+        if match:
+            return send(request, 200, json.dumps(self.project_articles(params)), "application/json")
+
+        if url.path.rstrip("/") == "/v1/projects":
+            return send(request, 200, json.dumps([{"name": "Benchmark"}]), "application/json")
+
+        send(request, 404, "Not found", "text/plain")
+
+    def send_error(self, request, path):
+        error = self.random.choice(["unavailable", "throttled", "maxlag"])
+
+        if error == "maxlag" and path.endswith("/api.php"):
+            body = {"error": {"code": "maxlag", "info": "Waiting for a database server"}}
+            return send(request, 200, json.dumps(body), "application/json", {"MediaWiki-API-Error": "maxlag", "Retry-After": "0"})
+
+        if error == "throttled":
+            return send(request, 429, "Too many requests", "text/plain", {"Retry-After": "0"})
+
+        send(request, 503, "Service unavailable", "text/plain")
+
+    # Synthetic data
+
+    def article_number(self, title):
+        match = re.match(r"^Article (\d+)", title)
+        if match and int(match.group(1)) < self.articles:
+            return int(match.group(1))
+        return None
+
+    def article_images(self, n):
+        return [
+            f"File:Image {(n * 7 + k * 13) % self.image_pool}.{FILE_TYPES[(n + k) % len(FILE_TYPES)]}"
+            for k in range(self.images_per_article)
+        ]
+
+    def wikitext(self, title):
+        n = self.article_number(title)
+        if n is None:
+            return ""
+
+        if self.redirect_every and n % self.redirect_every == 0 and "(target)" not in title:
+            return f"#REDIRECT [[Article {n} (target)]]"
+
+        images = self.article_images(n)
+        lines = ["{{Infobox", f"| image = {images[0][5:]}" if images else "| image =", "}}"]
+        lines += [f"[[{image}|thumb|Caption of {image}]] Text of article {n}." for image in images[1:]]
+        return "\n".join(lines)
+
+    def page(self, title, props, params):
+        n = self.article_number(title)
+        page = {"ns": 0, "title": title}
+
+        if title.startswith("File:"):
+            page["ns"] = 6
+            page["pageid"] = 10 ** 9 + zlib.crc32(title.encode()) % 10 ** 9
+
+            if "imageinfo" in props:
+                size = (zlib.crc32(title.encode()) % 4000) + 100
+                page["imageinfo"] = [{
+                    "url": f"{self.url}/images/{title[5:]}",
+                    "descriptionurl": f"{self.url}/wiki/{title}",
+                    "thumburl": f"{self.url}/images/thumb/{title[5:]}",
+                    "width": size,
+                    "height": size // 2,
+                }]
+
+            return page
+
+        if n is None:
+            page["missing"] = ""
+            return page
+
+        page["pageid"] = n + 1
+
+        if "info" in props:
+            page["lastrevid"] = 1000 + n
+            if "url" in params.get("inprop", ""):
+                page["fullurl"] = f"{self.url}/wiki/{title}"
+
+        if "categories" in props:
+            page["categories"] = [{"ns": 14, "title": f"Category:Category {(n + k) % 100}"} for k in range(3)]
+
+        if "pageassessments" in props:
+            page["pageassessments"] = {"Benchmark": {
+                "class": QUALITY_GRADES[n % len(QUALITY_GRADES)],
+                "importance": f"{IMPORTANCE_GRADES[n % len(IMPORTANCE_GRADES)]}-Class",
+            }}
+
+        if "images" in props:
+            page["images"] = [{"ns": 6, "title": image} for image in self.article_images(n)]
+
+        if "pageimages" in props:
+            images = self.article_images(n)
+            if images:
+                page["pageimage"] = images[0][5:]
+                page["original"] = {"source": f"{self.url}/images/{images[0][5:]}"}
+
+        return page
+
+    def query(self, params):
+        props = params.get("prop", "").split("|")
+        titles = [title for title in params.get("titles", "").split("|") if title]
+
+        normalized = []
+        redirects = []
+        pages = {}
+
+        for i, title in enumerate(titles):
+            # Underscores are normalized to spaces, like in MediaWiki
+            if "_" in title:
+                normalized.append({"from": title, "to": title.replace("_", " ")})
+                title = title.replace("_", " ")
+
+            n = self.article_number(title)
+            if params.get("redirects") and n is not None and self.redirect_every and n % self.redirect_every == 0 and "(target)" not in title:
+                redirects.append({"from": title, "to": f"Article {n} (target)"})
+                title = f"Article {n} (target)"
+
+            page = self.page(title, props, params)
+            pages[str(page.get("pageid", -(i + 1)))] = page
+
+        query = {"pages": pages}
+        if normalized:
+            query["normalized"] = normalized
+        if redirects:
+            query["redirects"] = redirects
+
+        return {"batchcomplete": "", "query": query}
+
+    def project_articles(self, params):
+        rows = int(params.get("numRows", 500))
+        page = int(params.get("page", 1))
+
+        articles = [{
+            "article": f"Article {n}",
+            "article_link": f"{self.url}/wiki/Article_{n}",
+            "article_history_link": "",
+            "article_talk": "",
+            "article_talk_link": "",
+            "quality": f"{QUALITY_GRADES[n % len(QUALITY_GRADES)]}-Class",
+            "quality_updated": "",
+            "importance": f"{IMPORTANCE_GRADES[n % len(IMPORTANCE_GRADES)]}-Class",
+            "importance_updated": "",
+        } for n in range((page - 1) * rows, min(page * rows, self.articles))]
+
+        return {
+            "pagination": {"total": self.articles, "total_pages": max(1, math.ceil(self.articles / rows)), "page": page},
+            "articles": articles,
+        }
+
+
+def send(request, status, body, content_type, headers=None):
+    data = body.encode("utf-8")
+
+    request.send_response(status)
+    request.send_header("Content-Type", f"{content_type}; charset=utf-8")
+    request.send_header("Content-Length", str(len(data)))
+    for key, value in (headers or {}).items():
+        request.send_header(key, value)
+    request.end_headers()
+
+    request.wfile.write(data)
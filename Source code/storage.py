@@ -0,0 +1,100 @@
+import pandas as pd
+import shutil
+import os
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+FORMATS = ["csv", "parquet"]
+
+# Format of the datasets shared between the extraction stages
+storage_format = "csv"
+
+# Typed columns of the Parquet datasets
+CATEGORY_COLUMNS = ["quality", "importance", "file_type", "resolution"]
+INTEGER_COLUMNS = ["width", "height", "n_images", "lastrevid"]
+
+
+def set_format(_format):
+    global storage_format
+
+    if _format not in FORMATS:
+        raise ValueError(f'Invalid storage format "{_format}", use one of {FORMATS}')
+
+    if _format == "parquet" and pyarrow is None:
+        raise ImportError('The "parquet" storage requires pyarrow: pip install pyarrow')
+
+    storage_format = _format
+
+
+def dataset_file(path):
+    # Parquet datasets are folders of parts, so that new rows can be appended
+    return f"{path}.{storage_format}"
+
+
+def dataset_exists(path):
+    return os.path.exists(dataset_file(path))
+
+
+def typed(df):
+    for column in CATEGORY_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype("category")
+
+    for column in INTEGER_COLUMNS:
+        if column in df:
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype("Int64")
+
+    return df
+
+
+def read_dataset(path):
+    if storage_format == "parquet":
+        parts = sorted(os.listdir(dataset_file(path)))
+        df = pd.concat([pd.read_parquet(os.path.join(dataset_file(path), part)) for part in parts], ignore_index=True)
+        return typed(df)
+
+    return pd.read_csv(dataset_file(path))
+
+
+def write_dataset(df, path):
+    # Written aside and then renamed, so that other stages never read a partial dataset
+    temp_path = f"{path}.tmp"
+
+    if storage_format == "parquet":
+        remove_dataset(temp_path)
+        append_dataset(df, temp_path)
+    else:
+        df.to_csv(dataset_file(temp_path), index=False, encoding='utf-8-sig')
+
+    replace_dataset(temp_path, path)
+
+
+def append_dataset(df, path):
+    if storage_format == "parquet":
+        os.makedirs(dataset_file(path), exist_ok=True)
+        part = f"part-{len(os.listdir(dataset_file(path))):05d}.parquet"
+        typed(df.copy()).to_parquet(os.path.join(dataset_file(path), part), index=False)
+    else:
+        df.to_csv(dataset_file(path), mode='a', header=not dataset_exists(path), index=False, encoding='utf-8-sig')
+
+
+def remove_dataset(path):
+    if os.path.isdir(dataset_file(path)):
+        shutil.rmtree(dataset_file(path))
+    elif os.path.exists(dataset_file(path)):
+        os.remove(dataset_file(path))
+
+
+def replace_dataset(source_path, path):
+    # Files are replaced at once, folders of parts have to be removed first
+    if os.path.isdir(dataset_file(path)):
+        remove_dataset(path)
+    os.replace(dataset_file(source_path), dataset_file(path))
+
+
+def export_csv(path):
+    read_dataset(path).to_csv(f"{path}.csv", index=False, encoding='utf-8-sig')
@@ -0,0 +1,74 @@
+from http_client import client, decode_json
+import threading
+import json
+import time
+import os
+
+
+WP1_URL = "https://api.wp1.openzim.org/v1/projects"
+
+REGISTRY_PATH = "output/wikiprojects.json"
+
+# Seconds before the cached list of Wikiprojects is refreshed
+REGISTRY_TTL = 24 * 60 * 60
+
+# Hosts used by the extraction, checked before starting
+API_HOSTS = [
+    "https://en.wikipedia.org/w/api.php",
+    "https://commons.wikimedia.org/w/api.php",
+    "https://api.wp1.openzim.org/v1/projects/",
+]
+
+
+def fetch_wikiprojects_list():
+    url = f"{WP1_URL}/"
+
+    r = client.get(url=url)
+    data = decode_json(r)
+
+    projects = []
+
+    for wp in data:
+        projects.append(wp["name"])
+
+    # Save the list for the next runs
+    if os.path.dirname(REGISTRY_PATH):
+        os.makedirs(os.path.dirname(REGISTRY_PATH), exist_ok=True)
+
+    with open(f"{REGISTRY_PATH}.part", "w") as outfile:
+        json.dump({"updated": time.time(), "projects": projects}, outfile)
+    os.replace(f"{REGISTRY_PATH}.part", REGISTRY_PATH)
+
+    return projects
+
+
+def extract_wikiprojects_list():
+    if not os.path.exists(REGISTRY_PATH):
+        return fetch_wikiprojects_list()
+
+    with open(REGISTRY_PATH) as infile:
+        registry = json.load(infile)
+
+    # An expired list is still used, while the new one is downloaded in background
+    if time.time() - registry["updated"] > REGISTRY_TTL:
+        threading.Thread(target=refresh_wikiprojects_list, daemon=True).start()
+
+    return registry["projects"]
+
+
+def refresh_wikiprojects_list():
+    try:
+        fetch_wikiprojects_list()
+    except Exception:
+        pass
+
+
+def check_connection():
+    # Lightweight requests to the hosts of the APIs, without retries
+    try:
+        for url in API_HOSTS:
+            client.session.head(url, timeout=5)
+        return True
+
+    except:
+        return False